@@ -2,26 +2,113 @@
 
 from mochila import plog
 
+from collections import OrderedDict
+import threading
+
 from pyproj import Transformer
 import numpy as np
 
-def enu2wgs(enu, lat, lon, h):
-    """Transform ENU to WGS84 coordinates."""
+# Max number of pipeline transformers kept by each thread
+TRANSFORMER_CACHE_SIZE = 32
+
+# pyproj transformers are not thread-safe, so each thread keeps its own pool
+_local = threading.local()
+
+
+def _get_pipeline_str(lat, lon, h):
+    """Get the ENU to WGS84 pipeline string for an origin."""
 
     pipeline_str = f"""
     +proj=pipeline
-    +step +inv +proj=topocentric +lon_0={lon} +lat_0={lat} +h_0={20}
+    +step +inv +proj=topocentric +lon_0={lon} +lat_0={lat} +h_0={h}
     +step +inv +proj=cart +ellps=WGS84
     """
     pipeline_str = ' '.join(pipeline_str.split())
 
-    pipe_trans = Transformer.from_pipeline(pipeline_str)
+    return pipeline_str
+
+
+def get_transformer(lat, lon, h):
+    """Get a cached ENU to WGS84 pipeline transformer for an origin.
+
+    Transformers are kept in a thread-local LRU pool of
+     TRANSFORMER_CACHE_SIZE items, keyed by the pipeline parameters.
+    """
+
+    pool = getattr(_local, 'pool', None)
+    if pool is None:
+        pool = _local.pool = OrderedDict()
+
+    key = (float(lat), float(lon), float(h))
+
+    pipe_trans = pool.get(key)
+    if pipe_trans is None:
+        pipe_trans = Transformer.from_pipeline(_get_pipeline_str(*key))
+        pool[key] = pipe_trans
+        if len(pool) > TRANSFORMER_CACHE_SIZE:
+            pool.popitem(last=False)
+    else:
+        pool.move_to_end(key)
+
+    return pipe_trans
+
+
+def clear_transformers():
+    """Clear the transformers pool of the current thread."""
+
+    pool = getattr(_local, 'pool', None)
+    if pool is not None:
+        pool.clear()
+
+
+def enu2wgs(enu, lat, lon, h):
+    """Transform ENU to WGS84 coordinates."""
+
+    pipe_trans = get_transformer(lat, lon, h)
 
     # Pyproj transformers expect list of coordinates instead of points, so transpose
-    e, n, u = np.array(enu).T
+    e, n, u = np.array(enu, dtype=float).T
 
     wgs = pipe_trans.transform(e, n, u)
 
     # Return list of points instead of coordinates, so transpose
     return np.array(wgs).T
 
+
+def enu2wgs_batch(enus, origins):
+    """Transform many ENU arrays, each one with its own origin.
+    -----
+    Params:
+        enus:           list
+                List of arrays of ENU points, each with shape (n_i, 3).
+        origins:        list
+                List of (lat, lon, h) origins, one per ENU array.
+    -----
+    Returns:
+        wgs_list:       list
+                List of arrays of WGS84 points, in the same order as enus.
+    """
+
+    if len(enus) != len(origins):
+        raise ValueError('There are not as many origins as ENU arrays.')
+
+    enus = [np.array(enu, dtype=float).reshape(-1, 3) for enu in enus]
+
+    # Group arrays by origin, so each transformer is called only once
+    groups = {}
+    for idx, origin in enumerate(origins):
+        key = tuple(float(v) for v in origin)
+        groups.setdefault(key, []).append(idx)
+
+    wgs_list = [None] * len(enus)
+
+    for (lat, lon, h), idxs in groups.items():
+        stacked = np.concatenate([enus[i] for i in idxs])
+        wgs = enu2wgs(stacked, lat, lon, h)
+
+        # Split the stacked result back to the original arrays
+        bounds = np.cumsum([len(enus[i]) for i in idxs])[:-1]
+        for i, part in zip(idxs, np.split(wgs, bounds)):
+            wgs_list[i] = part
+
+    return wgs_list
@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+"""
+Polygon geometries as numpy arrays
+
+Parse (multi)polygon WKB to numpy arrays of ring coordinates, build WKB
+from them, and remove spikes (vertices with a too sharp angle) from the
+rings with vectorized angle computations.
+
+This module does not depend on QGIS (nor on the mochila package), so
+its functions can run in worker processes.
+
+Notes
+-----
+
+Requires `numpy`.
+"""
+
+import struct
+
+import numpy as np
+
+WKB_POLYGON = 3
+WKB_MULTIPOLYGON = 6
+
+# Extended WKB (PostGIS) flags
+_EWKB_Z = 0x80000000
+_EWKB_M = 0x40000000
+_EWKB_SRID = 0x20000000
+
+
+# =================
+# Private functions
+# =================
+
+def _read_header(wkb, offset):
+    byte_order = '<' if wkb[offset] == 1 else '>'
+    wkb_type, = struct.unpack_from(byte_order + 'I', wkb, offset + 1)
+    offset += 5
+    has_z = bool(wkb_type & _EWKB_Z)
+    has_m = bool(wkb_type & _EWKB_M)
+    if wkb_type & _EWKB_SRID:
+        offset += 4
+    wkb_type &= 0x0FFFFFFF
+    # ISO WKB: 1000 Z, 2000 M, 3000 ZM
+    dim_code, base_type = divmod(wkb_type, 1000)
+    has_z = has_z or dim_code in (1, 3)
+    has_m = has_m or dim_code in (2, 3)
+    return byte_order, base_type, has_z, has_m, offset
+
+def _read_polygon(wkb, offset, byte_order, n_dims):
+    n_rings, = struct.unpack_from(byte_order + 'I', wkb, offset)
+    offset += 4
+    rings = []
+    for _ in range(n_rings):
+        n_points, = struct.unpack_from(byte_order + 'I', wkb, offset)
+        offset += 4
+        ring = np.frombuffer(wkb, dtype=byte_order + 'f8',
+                             count=n_points * n_dims,
+                             offset=offset).reshape(n_points, n_dims)
+        rings.append(ring.astype(float))
+        offset += 8 * n_points * n_dims
+    return rings, offset
+
+def _write_polygon(parts, rings, wkb_type):
+    parts.append(struct.pack('<BII', 1, wkb_type, len(rings)))
+    for ring in rings:
+        ring = np.ascontiguousarray(ring, dtype='<f8')
+        parts.append(struct.pack('<I', len(ring)))
+        parts.append(ring.tobytes())
+
+def _get_keep_mask(spikes, angles):
+    # Remove only the spikes sharper than their spike neighbours
+    # (ties broken by position), so two adjacent vertices are never
+    # removed together. The sharpest spike is always removed.
+    n = len(angles)
+    idx = np.arange(n)
+    remove = spikes.copy()
+    for shift in (1, -1):
+        nb_spikes = np.roll(spikes, shift)
+        nb_angles = np.roll(angles, shift)
+        nb_idx = np.roll(idx, shift)
+        nb_wins = nb_spikes & ((nb_angles < angles)
+                               | ((nb_angles == angles) & (nb_idx < idx)))
+        remove &= ~nb_wins
+    return ~remove
+
+
+# ================
+# Public functions
+# ================
+
+def parse_polygons_wkb(wkb):
+    """
+    Parse a Polygon or MultiPolygon WKB (ISO or extended) to arrays
+
+    Parameters
+    ----------
+    wkb : bytes
+        Polygon or MultiPolygon WKB.
+
+    Returns
+    -------
+    polygons : list
+        List of polygons, each one a list of rings (exterior first), each
+        one an array with shape ``(m, n_dims)`` (closed, as in the WKB).
+    is_multi : bool
+        If the geometry is a MultiPolygon.
+    has_z : bool
+        If the coordinates have Z values.
+    has_m : bool
+        If the coordinates have M values.
+    """
+
+    wkb = bytes(wkb)
+    byte_order, base_type, has_z, has_m, offset = _read_header(wkb, 0)
+    n_dims = 2 + has_z + has_m
+
+    if base_type == WKB_POLYGON:
+        rings, _ = _read_polygon(wkb, offset, byte_order, n_dims)
+        return [rings], False, has_z, has_m
+
+    if base_type == WKB_MULTIPOLYGON:
+        n_parts, = struct.unpack_from(byte_order + 'I', wkb, offset)
+        offset += 4
+        polygons = []
+        for _ in range(n_parts):
+            part_order, _, _, _, offset = _read_header(wkb, offset)
+            rings, offset = _read_polygon(wkb, offset, part_order, n_dims)
+            polygons.append(rings)
+        return polygons, True, has_z, has_m
+
+    err_msg = (f'WKB geometry type {base_type} is not a Polygon or '
+               'MultiPolygon.')
+    raise ValueError(err_msg)
+
+
+def build_polygons_wkb(polygons, is_multi, has_z=False, has_m=False):
+    """
+    Build a Polygon or MultiPolygon ISO WKB from arrays
+
+    Parameters are the same as the returns of `parse_polygons_wkb`. If
+    `is_multi` is False, `polygons` must have one polygon.
+    """
+
+    dim_code = (1 if has_z else 0) + (2 if has_m else 0)
+    polygon_type = WKB_POLYGON + 1000 * dim_code
+    parts = []
+
+    if is_multi:
+        parts.append(struct.pack('<BII', 1,
+                                 WKB_MULTIPOLYGON + 1000 * dim_code,
+                                 len(polygons)))
+        for rings in polygons:
+            _write_polygon(parts, rings, polygon_type)
+    else:
+        _write_polygon(parts, polygons[0] if polygons else [], polygon_type)
+
+    return b''.join(parts)
+
+
+def get_ring_angles(ring):
+    """
+    Compute the angle at each vertex of an open ring
+
+    The angle is between the vectors from each vertex to the previous
+    and to the next ones, in radians, in ``[0, pi]``. Vertices equal to
+    a neighbour get an angle of zero.
+
+    Parameters
+    ----------
+    ring : numpy.ndarray
+        Open ring (last vertex not repeated) with shape ``(m, >=2)``.
+        Only X and Y are used.
+
+    Returns
+    -------
+    angles : numpy.ndarray
+        Angles with shape ``(m,)``.
+    """
+
+    xy = ring[:, :2]
+    v1 = np.roll(xy, 1, axis=0) - xy
+    v2 = np.roll(xy, -1, axis=0) - xy
+    dot = (v1 * v2).sum(1)
+    cross = v1[:, 0] * v2[:, 1] - v1[:, 1] * v2[:, 0]
+    angles = np.arctan2(np.abs(cross), dot)
+    return angles
+
+
+def remove_ring_spikes(ring, threshold):
+    """
+    Remove the vertices of a ring with an angle of threshold or less
+
+    Spikes are removed iteratively (angles change when a neighbour is
+    removed) until there are no spikes left.
+
+    Parameters
+    ----------
+    ring : numpy.ndarray
+        Closed ring with shape ``(m, n_dims)``.
+    threshold : float
+        Max angle of a spike, in degrees.
+
+    Returns
+    -------
+    ring : numpy.ndarray or None
+        Closed ring without spikes, or None if less than three vertices
+        are left.
+    n_removed : int
+        Number of removed vertices.
+    """
+
+    threshold = np.radians(threshold)
+    open_ring = ring[:-1]
+    n_removed = 0
+
+    while len(open_ring) >= 3:
+        angles = get_ring_angles(open_ring)
+        spikes = angles <= threshold
+        if not spikes.any():
+            break
+        keep = _get_keep_mask(spikes, angles)
+        n_removed += int((~keep).sum())
+        open_ring = open_ring[keep]
+
+    if len(open_ring) < 3:
+        return None, len(ring) - 1
+
+    return np.concatenate((open_ring, open_ring[:1])), n_removed
+
+
+def remove_polygons_spikes(polygons, threshold):
+    """
+    Remove spikes from the rings of a list of polygons
+
+    Holes left with less than three vertices are dropped, and so are
+    polygons whose exterior ring is left with less than three vertices.
+
+    Returns
+    -------
+    polygons : list
+        Polygons without spikes.
+    n_removed : int
+        Number of removed vertices.
+    """
+
+    new_polygons = []
+    n_removed = 0
+    for rings in polygons:
+        new_rings = []
+        for i, ring in enumerate(rings):
+            new_ring, removed = remove_ring_spikes(ring, threshold)
+            n_removed += removed
+            if new_ring is None:
+                if i == 0:
+                    # Without exterior ring, the polygon is dropped
+                    break
+                continue
+            new_rings.append(new_ring)
+        if new_rings:
+            new_polygons.append(new_rings)
+    return new_polygons, n_removed
+
+
+def remove_wkb_spikes(wkb, threshold):
+    """
+    Remove spikes from a Polygon or MultiPolygon WKB
+
+    Parameters
+    ----------
+    wkb : bytes
+        Polygon or MultiPolygon WKB.
+    threshold : float
+        Max angle of a spike, in degrees.
+
+    Returns
+    -------
+    wkb : bytes
+        WKB without spikes, of the same type and dimensions.
+    n_removed : int
+        Number of removed vertices.
+    """
+
+    polygons, is_multi, has_z, has_m = parse_polygons_wkb(wkb)
+    polygons, n_removed = remove_polygons_spikes(polygons, threshold)
+    new_wkb = build_polygons_wkb(polygons, is_multi, has_z, has_m)
+    return new_wkb, n_removed
+
+
+def remove_wkbs_spikes(wkbs, threshold):
+    """
+    Remove spikes from a chunk of WKB geometries
+
+    Meant to be run in worker processes: it takes and returns only bytes
+    and numbers.
+
+    Parameters
+    ----------
+    wkbs : list
+        WKB geometries. None items (null geometries) are kept as None.
+    threshold : float
+        Max angle of a spike, in degrees.
+
+    Returns
+    -------
+    wkbs : list
+        WKB geometries without spikes. Geometries that are not Polygon or
+        MultiPolygon (e.g. curved ones) are returned as they are.
+    n_removed : int
+        Number of removed vertices.
+    n_skipped : int
+        Number of geometries returned as they are.
+    """
+
+    new_wkbs = []
+    n_removed = 0
+    n_skipped = 0
+    for wkb in wkbs:
+        if wkb is None:
+            new_wkbs.append(None)
+            continue
+        try:
+            new_wkb, removed = remove_wkb_spikes(wkb, threshold)
+        except ValueError:
+            new_wkbs.append(wkb)
+            n_skipped += 1
+        else:
+            new_wkbs.append(new_wkb)
+            n_removed += removed
+    return new_wkbs, n_removed, n_skipped
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+Register point sets without known correspondences (Iterative Closest Point)
+
+At each iteration, the source points are transformed with the current
+solution, matched to their closest target points with a KD-tree, and
+a new similarity transformation is found with `simil.process`.
+
+A coarse-to-fine schedule of subsample sizes can be used: the first
+levels use few source points to approach the solution quickly and the
+last ones refine it with more (or all) points.
+
+
+Notes
+-----
+
+Requires `numpy` and `scipy`.
+"""
+
+from mochila.utils import simil
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+def _get_subsample(n, size, rng):
+    """Get the indices of a random subsample of size points."""
+
+    if size is None or size >= n:
+        return np.arange(n)
+
+    return np.sort(rng.choice(n, size=size, replace=False))
+
+
+def _match(tree, coords, alpha, lambda_i, r_matrix, t_vector, max_distance,
+           workers):
+    """Match the transformed points to their closest target points."""
+
+    transformed = simil.apply(lambda_i, r_matrix, t_vector, coords)
+    dists, matches = tree.query(transformed,
+                                distance_upper_bound=max_distance,
+                                workers=workers)
+
+    # Unmatched points have infinite distance
+    matched = np.isfinite(dists)
+    if matched.sum() < 2:
+        err_msg = ('There are not two matched points, try a '
+                   'greater max_distance or a better initial '
+                   'solution.')
+        raise ValueError(err_msg)
+
+    rms = np.sqrt(np.average(dists[matched]**2, weights=alpha[matched]))
+
+    return matched, matches, rms
+
+
+def register(source_points,
+             target_points,
+             alpha_0=None,
+             scale=True,
+             lambda_0=1.0,
+             initial=None,
+             schedule=None,
+             max_distance=np.inf,
+             max_iterations=50,
+             tolerance=1e-6,
+             workers=-1,
+             seed=None):
+    """
+    Find similarity transformation parameters that align two point sets
+
+    Parameters
+    ----------
+    source_points : array_like
+        Source points with shape ``(n, 3)``.
+    target_points : array_like
+        Target points with shape ``(m, 3)``. There is no need of as many
+        target points as source points.
+    alpha_0 : array_like, optional
+        Per source point weights, with shape ``(n,)``.
+    scale : boolean, optional
+        Allow to find a multiplier factor different from lambda_0.
+        Default is True.
+    lambda_0 : float, optional
+        Multiplier factor of the first solution. If `scale=True`, each
+        iteration starts from the previous multiplier factor. If it is
+        negative, forces mirroring. Can't be zero. Default is 1.0.
+    initial : tuple, optional
+        Initial ``(lambda_i, r_matrix, t_vector)`` solution. Default is
+        `lambda_0`, the identity rotation and no translation.
+    schedule : list, optional
+        Number of source points used at each level, from coarse to fine.
+        None means all the points. Default is ``[None]``.
+    max_distance : float, optional
+        Max distance between matched points. Default is no limit.
+    max_iterations : int, optional
+        Max number of iterations per level. Default is 50.
+    tolerance : float, optional
+        A level stops when the RMS of the matching distances changes
+        less than `tolerance`. Default is 1e-6.
+    workers : int, optional
+        Number of workers of the KD-tree queries (-1 means all the CPUs).
+        Default is -1.
+    seed : int, optional
+        Seed for the subsamples. Default is None.
+
+    Returns
+    -------
+    lambda_i : float
+        Multiplier factor.
+    r_matrix : numpy.ndarray
+        Rotation matrix.
+    t_vector : numpy.ndarray
+        Translation (column) vector.
+    rms : float
+        RMS of the matching distances of the last iteration.
+    """
+
+
+    # declarations and checkups
+
+    source_coords = np.asarray(source_points, dtype=float)
+    target_coords = np.asarray(target_points, dtype=float)
+
+    if source_coords.ndim != 2 or source_coords.shape[1] != 3:
+        err_msg = ('source_points array must have shape (n, 3).')
+        raise ValueError(err_msg)
+
+    if target_coords.ndim != 2 or target_coords.shape[1] != 3:
+        err_msg = ('target_points array must have shape (m, 3).')
+        raise ValueError(err_msg)
+
+    n = source_coords.shape[0]
+
+    if alpha_0 is None:
+        alpha_0 = np.ones(n)
+    else:
+        alpha_0 = np.asarray(alpha_0, dtype=float)
+
+    if alpha_0.shape != (n,):
+        err_msg = ('There are not as many alpha_0 coefficients as '
+                   'source points.')
+        raise ValueError(err_msg)
+
+    lambda_0 = float(lambda_0)
+
+    if lambda_0 == 0:
+        err_msg = ('lambda_0 cannot be zero.')
+        raise ValueError(err_msg)
+
+    if initial is None:
+        initial = (lambda_0, np.eye(3), np.zeros((3, 1)))
+
+    if schedule is None:
+        schedule = [None]
+
+
+    # processes
+
+    lambda_i, r_matrix, t_vector = initial
+
+    rng = np.random.default_rng(seed)
+
+    # The target tree is built once and queried at every iteration
+    tree = cKDTree(target_coords)
+
+    rms = np.inf
+
+    for size in schedule:
+        idxs = _get_subsample(n, size, rng)
+        level_coords = source_coords[idxs]
+        level_alpha = alpha_0[idxs]
+        prev_rms = np.inf
+
+        for _ in range(max_iterations):
+            matched, matches, rms = _match(tree, level_coords, level_alpha,
+                                           lambda_i, r_matrix, t_vector,
+                                           max_distance, workers)
+            if abs(prev_rms - rms) < tolerance:
+                break
+            prev_rms = rms
+
+            lambda_i, r_matrix, t_vector = simil.process(
+                level_coords[matched],
+                target_coords[matches[matched]],
+                alpha_0=level_alpha[matched],
+                scale=scale,
+                lambda_0=lambda_i if scale else lambda_0)
+        else:
+            # Without convergence, the last rms is of the previous
+            #  solution, so measure the returned one
+            _, _, rms = _match(tree, level_coords, level_alpha,
+                               lambda_i, r_matrix, t_vector,
+                               max_distance, workers)
+
+    return lambda_i, r_matrix, t_vector, rms
@@ -29,6 +29,14 @@ Where:
 Per point weights can be used.  
 The solution can be forced to mirror and/or to fixed scale.  
 
+Many independent problems can be solved at once with `process_batch`.  
+Large sets of points can be processed in chunks: the weighted moments
+of the coordinates are accumulated with `get_moments` and solved with
+`process_moments` (or just pass `chunk_size` to `process`).  
+Control points with gross outliers can be processed with `ransac`.  
+Residuals and leave-one-out residuals are computed with `diagnostics`.  
+Planar control points can be processed in closed form with `process_2d`.  
+
 
 Notes
 -----
@@ -85,6 +93,16 @@ so transpose:
  [6.  2.5 3.5]
  [7.5 5.5 3.5]]
 
+Or use `apply`, which transforms the points (also `numpy.memmap` arrays)
+in chunks, without transposed copies:
+
+>>> print(simil.apply(m, r, t, source_points))
+[[3.  7.  5. ]
+ [6.  7.  2. ]
+ [4.5 4.  0.5]
+ [6.  2.5 3.5]
+ [7.5 5.5 3.5]]
+
 To force a fixed scale of 1.25:
 
 >>> m, r, t = simil.process(source_points,
@@ -124,14 +142,31 @@ Per point weights can be passed as a list:
  [4.604 4.703 1.698]
  [5.604 3.703 3.698]
  [6.604 5.703 3.698]]
+
+Many problems can be stacked (or passed as ragged groups with
+`offsets`) and solved at once:
+
+>>> source_stack = np.array([source_points, source_points])
+>>> target_stack = np.array([target_points, source_points])
+>>> m, r, t = simil.process_batch(source_stack, target_stack)
+>>> m
+array([1.5, 1. ])
 """
 
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 
 # =================
 # Private functions
 # =================
 
+# Max number of iterations to find the multiplier factor
+_MAX_ITER = 1000
+
+# Number of points of the minimal sample of a 3-D similarity
+_MIN_SAMPLE = 3
+
 def _get_scalar(alpha_0, q_coords=None):
     if q_coords is None:
         scalar = np.einsum('i->', alpha_0)
@@ -140,18 +175,20 @@ def _get_scalar(alpha_0, q_coords=None):
     return scalar
 
 def _get_q_matrix(quaternions):
-    q_matrix = [[[q[3], -q[2], q[1], q[0]],
-                 [q[2], q[3] , -q[0], q[1]],
-                 [-q[1], q[0], q[3], q[2]],
-                 [-q[0], -q[1], -q[2], q[3]]] for q in quaternions]
-    return np.array(q_matrix)
+    x, y, z, w = np.moveaxis(np.asarray(quaternions, dtype=float), -1, 0)
+    q_matrix = np.stack([np.stack([w, -z, y, x], -1),
+                         np.stack([z, w, -x, y], -1),
+                         np.stack([-y, x, w, z], -1),
+                         np.stack([-x, -y, -z, w], -1)], -2)
+    return q_matrix
 
 def _get_w_matrix(quaternions):
-    w_matrix = [[[q[3], q[2], -q[1], q[0]],
-                 [-q[2], q[3] , q[0], q[1]],
-                 [q[1], -q[0], q[3], q[2]],
-                 [-q[0], -q[1], -q[2], q[3]]] for q in quaternions]
-    return np.array(w_matrix)
+    x, y, z, w = np.moveaxis(np.asarray(quaternions, dtype=float), -1, 0)
+    w_matrix = np.stack([np.stack([w, z, -y, x], -1),
+                         np.stack([-z, w, x, y], -1),
+                         np.stack([y, -x, w, z], -1),
+                         np.stack([-x, -y, -z, w], -1)], -2)
+    return w_matrix
 
 def _get_abc_matrices(alpha_0, m1, m2=None):
     if m2 is None:
@@ -171,7 +208,8 @@ def _get_d_matrix(li, cs, am, blcm):
     return d_matrix
 
 def _get_r_quat(d_matrix):
-    eigvals, eigvects = np.linalg.eig(d_matrix)
+    # D is symmetric, eigh returns eigenvalues in ascending order
+    eigvals, eigvects = np.linalg.eigh(d_matrix)
     beta_1 = np.argmax(eigvals)
     r_quat = eigvects[:,beta_1]
     return beta_1, r_quat
@@ -184,18 +222,16 @@ def _get_lambda_next(am, bs, bm, cs, cm, rq):
     return lambda_next
 
 def _get_solution(am, bs, bm, cs, cm, scale, li, i):
-    blc_matrix = _get_blc_matrix(bm, li, cm)
-    d_matrix = _get_d_matrix(li, cs, am, blc_matrix)
-    beta_1, r_quat = _get_r_quat(d_matrix)
-    if scale is False:
-        return blc_matrix, d_matrix, beta_1, r_quat, li, i
-    else:
+    while True:
+        blc_matrix = _get_blc_matrix(bm, li, cm)
+        d_matrix = _get_d_matrix(li, cs, am, blc_matrix)
+        beta_1, r_quat = _get_r_quat(d_matrix)
+        if scale is False:
+            return blc_matrix, d_matrix, beta_1, r_quat, li, i
         lambda_next = _get_lambda_next(am, bs, bm, cs, cm, r_quat)
-        if abs(li-lambda_next) < 0.000001:
+        if abs(li-lambda_next) < 0.000001 or i >= _MAX_ITER:
             return blc_matrix, d_matrix, beta_1, r_quat, li, i
-        else:
-            li, i = lambda_next, i+1
-            return _get_solution(am, bs, bm, cs, cm, scale, li, i)
+        li, i = lambda_next, i+1
 
 def _get_r_matrix(r_quat):
     r_w_matrix = _get_w_matrix([r_quat])[0]
@@ -212,6 +248,223 @@ def _get_t_vector(r_quat, s_quat):
     t_vector = [2 * (r_w_matrix.T @ s_quat)[:3]]
     return t_vector 
    
+# Moments layout: [w, s_x, s_y, s_z, t_x, t_y, t_z, ss, tt, st (3x3)]
+_N_MOMENTS = 18
+
+def _get_moments(alpha_0, source_coords, target_coords, offsets=None):
+    # Weighted sums of the (..., n, 3) coordinates and their products,
+    # with ragged (N, 3) coordinates reduced by offsets if provided
+    weighted_coords = alpha_0[..., None] * source_coords
+    parts = [alpha_0[..., None],
+             weighted_coords,
+             alpha_0[..., None] * target_coords,
+             (weighted_coords * source_coords).sum(-1)[..., None],
+             (alpha_0[..., None] * target_coords**2).sum(-1)[..., None],
+             (weighted_coords[..., :, None]
+              * target_coords[..., None, :]).reshape(
+                  weighted_coords.shape[:-1] + (9,))]
+    per_point = np.concatenate(parts, axis=-1)
+    if offsets is None:
+        moments = per_point.sum(-2)
+    else:
+        moments = np.add.reduceat(per_point, offsets[:-1], axis=0)
+    return moments
+
+def _get_basis_matrices():
+    basis = np.eye(4)[:3]
+    w_basis = _get_w_matrix(basis)
+    q_basis = _get_q_matrix(basis)
+    wq_basis = np.einsum('aji,bjl->abil', w_basis, q_basis)
+    return w_basis, q_basis, wq_basis
+
+_W_BASIS, _Q_BASIS, _WQ_BASIS = _get_basis_matrices()
+
+def _get_abc_from_moments(moments):
+    # W and Q are linear in the coordinates, so the weighted sums of
+    # W, Q and W.T @ Q come from the moments and the basis matrices
+    c_scalar = moments[..., 0]
+    b_scalar = moments[..., 7]
+    st = moments[..., 9:].reshape(moments.shape[:-1] + (3, 3))
+    a_matrix = np.einsum('...ab,abij->...ij', st, _WQ_BASIS)
+    b_matrix = np.einsum('...b,bij->...ij', moments[..., 4:7], _Q_BASIS)
+    c_matrix = np.einsum('...a,aij->...ij', moments[..., 1:4], _W_BASIS)
+    return a_matrix, b_scalar, b_matrix, c_scalar, c_matrix
+
+def _get_batch_solutions(am, bs, bm, cs, cm, scale, lambda_0):
+    # Same iteration as _get_solution, over k problems at once.
+    # Only the problems that have not converged are solved again.
+    k = bs.shape[0]
+    lambda_i = np.array(np.broadcast_to(np.asarray(lambda_0, dtype=float),
+                                        (k,)))
+    blc_matrix = np.empty((k, 4, 4))
+    r_quat = np.empty((k, 4))
+    failed = np.zeros(k, dtype=bool)
+    active = np.arange(k)
+    for _ in range(_MAX_ITER):
+        li = lambda_i[active]
+        blcm = bm[active] - li[:, None, None] * cm[active]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            dm = (2 * li[:, None, None] * am[active]
+                  + (1 / cs[active])[:, None, None]
+                  * (np.transpose(blcm, (0, 2, 1)) @ blcm))
+        # Degenerate problems (e.g. coincident source points) give a
+        # non-finite D, that would make eigh fail for all the problems
+        finite = np.isfinite(dm).all((1, 2))
+        if not finite.all():
+            failed[active[~finite]] = True
+            active, li = active[finite], li[finite]
+            blcm, dm = blcm[finite], dm[finite]
+            if active.size == 0:
+                break
+        # D is symmetric, eigh returns eigenvalues in ascending order
+        rq = np.linalg.eigh(dm)[1][:, :, -1]
+        blc_matrix[active], r_quat[active] = blcm, rq
+        if scale is False:
+            break
+        lambda_next = _get_batch_lambda_next(am[active], bs[active],
+                                             bm[active], cs[active],
+                                             cm[active], rq)
+        converged = np.abs(li - lambda_next) < 0.000001
+        lambda_i[active[~converged]] = lambda_next[~converged]
+        active = active[~converged]
+        if active.size == 0:
+            break
+    blc_matrix[failed] = np.nan
+    r_quat[failed] = np.nan
+    lambda_i[failed] = np.nan
+    return blc_matrix, r_quat, lambda_i
+
+def _get_batch_lambda_next(am, bs, bm, cs, cm, rq):
+    expr_1 = np.einsum('ki,kij,kj->k', rq, am, rq)
+    expr_2 = (1/cs) * np.einsum('ki,kji,kjl,kl->k', rq, bm, cm, rq)
+    expr_3 = (1/cs) * np.einsum('ki,kji,kjl,kl->k', rq, cm, cm, rq)
+    # Non-finite for degenerate problems, discarded in the next iteration
+    with np.errstate(divide='ignore', invalid='ignore'):
+        lambda_next = (expr_1-expr_2) / (bs-expr_3)
+    return lambda_next
+
+def _get_batch_rt(c_scalar, blc_matrix, r_quat):
+    r_w_matrix = _get_w_matrix(r_quat)
+    r_q_matrix = _get_q_matrix(r_quat)
+    r_wt_matrix = np.transpose(r_w_matrix, (0, 2, 1))
+    r_matrix = (r_wt_matrix @ r_q_matrix)[:, :3, :3]
+    s_quat = (1/(2*c_scalar))[:, None] * np.einsum('kij,kj->ki',
+                                                   blc_matrix, r_quat)
+    t_vector = 2 * np.einsum('kij,kj->ki', r_wt_matrix, s_quat)[:, :3, None]
+    return r_matrix, t_vector
+
+def _get_batch_residuals(lambda_i, r_matrix, t_vector, source_coords,
+                         target_coords):
+    # Distances between transformed source and target (n, 3) points,
+    # for k solutions at once, with shape (k, n)
+    transformed = (lambda_i[:, None, None]
+                   * np.einsum('kij,nj->kni', r_matrix, source_coords)
+                   + t_vector[:, None, :, 0])
+    residuals = np.sqrt(((transformed - target_coords)**2).sum(-1))
+    return residuals
+
+def _get_ransac_hypotheses(source_coords, target_coords, threshold, scale,
+                           lambda_0, n, rng):
+    # Solve n minimal samples and count the inliers of each solution
+    m = source_coords.shape[0]
+    # Three distinct indices per sample, without sorting all the points
+    i_0 = rng.integers(0, m, n)
+    i_1 = rng.integers(0, m - 1, n)
+    i_1 += i_1 >= i_0
+    i_2 = rng.integers(0, m - 2, n)
+    i_2 += i_2 >= np.minimum(i_0, i_1)
+    i_2 += i_2 >= np.maximum(i_0, i_1)
+    sample = np.stack((i_0, i_1, i_2), axis=1)
+    # Samples with coincident source points (e.g. repeated control
+    # points) are degenerate, they are not solved and get no inliers
+    sample_coords = source_coords[sample]
+    degenerate = ((sample_coords[:, 0] == sample_coords[:, 1]).all(1)
+                  | (sample_coords[:, 0] == sample_coords[:, 2]).all(1)
+                  | (sample_coords[:, 1] == sample_coords[:, 2]).all(1))
+    if degenerate.all():
+        return 0, 0.0, sample[0]
+    sample = sample[~degenerate]
+    moments = _get_moments(np.ones(sample.shape),
+                           source_coords[sample],
+                           target_coords[sample])
+    a_matrix, b_scalar, b_matrix, c_scalar, c_matrix = _get_abc_from_moments(
+                                                                    moments)
+    blc_matrix, r_quat, lambda_i = _get_batch_solutions(a_matrix,
+                                                        b_scalar,
+                                                        b_matrix,
+                                                        c_scalar,
+                                                        c_matrix,
+                                                        scale,
+                                                        lambda_0)
+    r_matrix, t_vector = _get_batch_rt(c_scalar, blc_matrix, r_quat)
+    residuals = _get_batch_residuals(lambda_i, r_matrix, t_vector,
+                                     source_coords, target_coords)
+    # NaN residuals (samples whose iteration broke down) are never
+    # inliers
+    inliers = residuals < threshold
+    counts = inliers.sum(1)
+    errors = np.where(inliers, residuals**2, 0).sum(1)
+    best = np.lexsort((errors, -counts))[0]
+    return counts[best], errors[best], sample[best]
+
+def _get_helmert_2d(c_scalar, source_sum, target_sum, st_sum, ss_sum,
+                    scale, lambda_0):
+    # Weighted least squares of z_t = a * z_s + b with complex numbers
+    # (z_s conjugated if mirroring), from the weighted sums of the
+    # coordinates and their products, with leading axes
+    source_centroid = source_sum / c_scalar
+    target_centroid = target_sum / c_scalar
+    st_centered = (st_sum
+                   - c_scalar * np.conj(source_centroid) * target_centroid)
+    ss_centered = ss_sum - c_scalar * np.abs(source_centroid)**2
+    if scale is False:
+        a_complex = np.abs(lambda_0) * np.exp(1j * np.angle(st_centered))
+    else:
+        a_complex = st_centered / ss_centered
+    b_complex = target_centroid - a_complex * source_centroid
+    lambda_i = np.sign(lambda_0) * np.abs(a_complex)
+    # M * R must be the matrix of z -> a * z (or a * conj(z) if mirroring)
+    ax, ay = a_complex.real / lambda_i, a_complex.imag / lambda_i
+    r_matrix = np.empty(np.shape(lambda_i) + (2, 2))
+    r_matrix[..., 0, 0] = ax
+    r_matrix[..., 1, 0] = ay
+    if lambda_0 < 0:
+        r_matrix[..., 0, 1] = ay
+        r_matrix[..., 1, 1] = -ax
+    else:
+        r_matrix[..., 0, 1] = -ay
+        r_matrix[..., 1, 1] = ax
+    t_vector = np.empty(np.shape(lambda_i) + (2, 1))
+    t_vector[..., 0, 0] = b_complex.real
+    t_vector[..., 1, 0] = b_complex.imag
+    return lambda_i, r_matrix, t_vector
+
+def _get_complex_sums(alpha_0, source_coords, target_coords, lambda_0,
+                      offsets=None):
+    # Weighted sums of (..., n, 2) coordinates as complex numbers
+    source_complex = source_coords[..., 0] + 1j * source_coords[..., 1]
+    target_complex = target_coords[..., 0] + 1j * target_coords[..., 1]
+    if lambda_0 < 0:
+        source_complex = np.conj(source_complex)
+    if offsets is None:
+        weighted_conj = alpha_0 * np.conj(source_complex)
+        sums = (alpha_0.sum(-1) + 0j,
+                (alpha_0 * source_complex).sum(-1),
+                (alpha_0 * target_complex).sum(-1),
+                (weighted_conj * target_complex).sum(-1),
+                (weighted_conj * source_complex).sum(-1))
+    else:
+        per_point = np.stack([alpha_0 + 0j,
+                              alpha_0 * source_complex,
+                              alpha_0 * target_complex,
+                              alpha_0 * np.conj(source_complex)
+                              * target_complex,
+                              alpha_0 * np.abs(source_complex)**2 + 0j], -1)
+        sums = np.moveaxis(np.add.reduceat(per_point, offsets[:-1], axis=0),
+                           -1, 0)
+    c_scalar, source_sum, target_sum, st_sum, ss_sum = sums
+    return c_scalar.real, source_sum, target_sum, st_sum, ss_sum.real
+
 # ================
 # Process function
 # ================
@@ -220,7 +473,8 @@ def process(source_points,
             target_points,
             alpha_0=None,
             scale=True,
-            lambda_0=1.0):
+            lambda_0=1.0,
+            chunk_size=None):
     """
     Find similarity transformation parameters given a set of control points
     
@@ -246,8 +500,15 @@ def process(source_points,
         Default is True.
     lambda_0 : float, optional
         Multiplier factor to find the first solution. Default is 1.0.
-        If `scale=True`, a recursion is implemented to find a better
-        value. If it is negative, forces mirroring. Can't be zero.
+        If `scale=True`, it is updated in a loop until it converges,
+        for at most `_MAX_ITER` iterations (when the limit is reached
+        the last value is used, without warning). If it is negative,
+        forces mirroring. Can't be zero.
+    chunk_size : int, optional
+        If provided, accumulate the A, B and C matrices from the
+        coordinates moments, processing `chunk_size` points at a time
+        (see `get_moments`). Peak memory doesn't grow with the number
+        of points. Default is None.
 
     Returns
     -------
@@ -260,6 +521,13 @@ def process(source_points,
     """
     
     
+    if chunk_size is not None:
+        moments = get_moments(source_points,
+                              target_points,
+                              alpha_0,
+                              chunk_size=chunk_size)
+        return process_moments(moments, scale=scale, lambda_0=lambda_0)
+
     # declarations and checkups
 
     source_coords = np.array(source_points, dtype=float).T
@@ -351,3 +619,1000 @@ def process(source_points,
     t_vector = np.array(_get_t_vector(r_quat, s_quat)).reshape(3,1)
     
     return lambda_i, r_matrix, t_vector
+
+
+# ================
+# Moment functions
+# ================
+
+def get_moments(source_points,
+                target_points,
+                alpha_0=None,
+                chunk_size=100000):
+    """
+    Accumulate the weighted moments of a set of control points
+    
+    The moments (sums of weights, coordinates and their products) are
+    all that is needed to build the A, B and C matrices, so they can be
+    accumulated chunk by chunk, and added or subtracted between sets of
+    points. Source and target points can be `numpy.memmap` arrays.
+    
+    Parameters
+    ----------
+    source_points : array_like
+        Source points with shape ``(n, 3)``.
+    target_points : array_like
+        Target points with shape ``(n, 3)``.
+    alpha_0 : array_like, optional
+        Per point weights, with shape ``(n,)``.
+    chunk_size : int, optional
+        Number of points processed at a time. Default is 100000.
+
+    Returns
+    -------
+    moments : numpy.ndarray
+        Moments array with shape ``(18,)``, to be passed to
+        `process_moments`.
+    """
+    
+    
+    # declarations and checkups
+
+    source_coords = np.asarray(source_points)
+    target_coords = np.asarray(target_points)
+
+    if source_coords.ndim != 2 or source_coords.shape[1] != 3:
+        err_msg = ('source_points array must have shape (n, 3).')
+        raise ValueError(err_msg)
+
+    n = source_coords.shape[0]
+
+    if n < 2:
+        err_msg = ('There are not two distinct source points.')
+        raise ValueError(err_msg)
+
+    if target_coords.shape != source_coords.shape:
+        err_msg = ('There are not as many target points as source points.')
+        raise ValueError(err_msg)
+
+    if alpha_0 is not None:
+        alpha_0 = np.asarray(alpha_0)
+        if alpha_0.shape != (n,):
+            err_msg = ('There are not as many alpha_0 coefficients as '
+                       'control points.')
+            raise ValueError(err_msg)
+
+    chunk_size = int(chunk_size)
+
+    if chunk_size < 1:
+        err_msg = ('chunk_size must be greater than zero.')
+        raise ValueError(err_msg)
+
+
+    # processes
+
+    first_point = np.array(source_coords[0], dtype=float)
+    distinct = False
+    moments = np.zeros(_N_MOMENTS)
+
+    for start in range(0, n, chunk_size):
+        source_chunk = np.asarray(source_coords[start:start+chunk_size],
+                                  dtype=float)
+        target_chunk = np.asarray(target_coords[start:start+chunk_size],
+                                  dtype=float)
+        if alpha_0 is None:
+            alpha_chunk = np.ones(source_chunk.shape[0])
+        else:
+            alpha_chunk = np.asarray(alpha_0[start:start+chunk_size],
+                                     dtype=float)
+        distinct = distinct or bool((source_chunk != first_point).any())
+        moments += _get_moments(alpha_chunk, source_chunk, target_chunk)
+
+    if not distinct:
+        err_msg = ('There are not two distinct source points.')
+        raise ValueError(err_msg)
+
+    return moments
+
+
+def process_moments(moments, scale=True, lambda_0=1.0):
+    """
+    Find similarity transformation parameters from accumulated moments
+    
+    Parameters
+    ----------
+    moments : array_like
+        Moments with shape ``(18,)``, as returned by `get_moments`, or
+        stacked moments with shape ``(k, 18)``.
+    scale : boolean, optional
+        Allow to find a multiplier factor different from lambda_0.
+        Default is True.
+    lambda_0 : float, optional
+        Multiplier factor to find the first solution. Default is 1.0.
+        If negative, forces mirroring. Can't be zero.
+
+    Returns
+    -------
+    lambda_i : float or numpy.ndarray
+        Multiplier factor, or factors with shape ``(k,)``.
+    r_matrix : numpy.ndarray
+        Rotation matrix, or matrices with shape ``(k, 3, 3)``.
+    t_vector : numpy.ndarray
+        Translation (column) vector, or vectors with shape ``(k, 3, 1)``.
+    """
+    
+    
+    # declarations and checkups
+
+    moments = np.asarray(moments, dtype=float)
+
+    if moments.ndim not in (1, 2) or moments.shape[-1] != _N_MOMENTS:
+        err_msg = (f'moments array must have shape ({_N_MOMENTS},) or '
+                   f'(k, {_N_MOMENTS}).')
+        raise ValueError(err_msg)
+
+    if (np.asarray(lambda_0) == 0).any():
+        err_msg = ('lambda_0 cannot be zero.')
+        raise ValueError(err_msg)
+
+
+    # processes
+
+    a_matrix, b_scalar, b_matrix, c_scalar, c_matrix = (
+        _get_abc_from_moments(moments.reshape(-1, _N_MOMENTS)))
+
+    blc_matrix, r_quat, lambda_i = _get_batch_solutions(a_matrix,
+                                                        b_scalar,
+                                                        b_matrix,
+                                                        c_scalar,
+                                                        c_matrix,
+                                                        scale,
+                                                        lambda_0)
+
+    r_matrix, t_vector = _get_batch_rt(c_scalar, blc_matrix, r_quat)
+
+    if moments.ndim == 1:
+        return lambda_i[0], r_matrix[0], t_vector[0]
+
+    return lambda_i, r_matrix, t_vector
+
+
+# ==================
+# Incremental solver
+# ==================
+
+class SimilSolver:
+    """
+    Incremental similarity transformation solver
+    
+    Keeps the running weighted moments (and so the A, B and C matrices)
+    of a set of control points, so points can be added, removed or
+    reweighted in O(1) per point and the solution found again without
+    processing all the points. Each new solution starts the iteration of
+    the multiplier factor from the previous one.
+    
+    Parameters
+    ----------
+    scale : boolean, optional
+        Allow to find a multiplier factor different from lambda_0.
+        Default is True.
+    lambda_0 : float, optional
+        Multiplier factor to find the first solution. Default is 1.0.
+        If negative, forces mirroring. Can't be zero.
+
+    Examples
+    --------
+    
+    >>> import simil
+    >>> source_points = [[0, 0, 0],
+    ...                  [0, 2, 2],
+    ...                  [2, 3, 1],
+    ...                  [3, 1, 2],
+    ...                  [1, 1, 3]]
+    >>> target_points = [[3.0, 7.0, 5.0],
+    ...                  [6.0, 7.0, 2.0],
+    ...                  [4.5, 4.0, 0.5],
+    ...                  [6.0, 2.5, 3.5],
+    ...                  [7.5, 5.5, 3.5]]
+    >>> solver = simil.SimilSolver()
+    >>> ids = solver.add_points(source_points, target_points)
+    >>> m, r, t = solver.solve()
+    >>> print(round(m, 3))
+    1.5
+    >>> solver.remove_points(ids[:1])
+    >>> len(solver)
+    4
+    >>> m, r, t = solver.solve()
+    >>> print(round(m, 3))
+    1.5
+    """
+
+    def __init__(self, scale=True, lambda_0=1.0):
+        lambda_0 = float(lambda_0)
+        if lambda_0 == 0:
+            err_msg = ('lambda_0 cannot be zero.')
+            raise ValueError(err_msg)
+        self.scale = scale
+        self.lambda_0 = lambda_0
+        self.lambda_i = lambda_0
+        self.moments = np.zeros(_N_MOMENTS)
+        self._points = {}
+        self._next_id = 0
+
+    def __len__(self):
+        return len(self._points)
+
+    def _check_ids(self, point_ids):
+        # Check before changing the moments, so they are never left
+        # half updated
+        unknown = [i for i in point_ids if i not in self._points]
+        if unknown:
+            err_msg = (f'There are no control points with ids {unknown}.')
+            raise ValueError(err_msg)
+
+    def _point_moments(self, point_ids):
+        source, target, alpha = zip(*(self._points[i] for i in point_ids))
+        return _get_moments(np.array(alpha),
+                            np.array(source),
+                            np.array(target))
+
+    def add_points(self, source_points, target_points, alpha_0=None):
+        """Add control points and return their ids."""
+        source_coords = np.array(source_points, dtype=float).reshape(-1, 3)
+        target_coords = np.array(target_points, dtype=float).reshape(-1, 3)
+        if target_coords.shape != source_coords.shape:
+            err_msg = ('There are not as many target points as source '
+                       'points.')
+            raise ValueError(err_msg)
+        n = source_coords.shape[0]
+        if alpha_0 is None:
+            alpha_0 = np.ones(n)
+        else:
+            alpha_0 = np.array(alpha_0, dtype=float).reshape(-1)
+        if alpha_0.shape != (n,):
+            err_msg = ('There are not as many alpha_0 coefficients as '
+                       'control points.')
+            raise ValueError(err_msg)
+        point_ids = list(range(self._next_id, self._next_id + n))
+        self._next_id += n
+        self._points.update(zip(point_ids,
+                                zip(source_coords, target_coords, alpha_0)))
+        self.moments += _get_moments(alpha_0, source_coords, target_coords)
+        return point_ids
+
+    def remove_points(self, point_ids):
+        """Remove control points by their ids."""
+        # Repeated ids are removed once
+        point_ids = list(dict.fromkeys(point_ids))
+        if not point_ids:
+            return
+        self._check_ids(point_ids)
+        self.moments -= self._point_moments(point_ids)
+        for i in point_ids:
+            del self._points[i]
+        if not self._points:
+            # Avoid to carry rounding errors to the next points
+            self.moments[:] = 0
+
+    def reweight(self, point_ids, alpha_0):
+        """Change the weights of control points by their ids."""
+        point_ids = list(point_ids)
+        if len(set(point_ids)) != len(point_ids):
+            err_msg = ('There are repeated point ids.')
+            raise ValueError(err_msg)
+        self._check_ids(point_ids)
+        alpha_0 = np.broadcast_to(np.asarray(alpha_0, dtype=float),
+                                  (len(point_ids),))
+        self.moments -= self._point_moments(point_ids)
+        for i, alpha in zip(point_ids, alpha_0):
+            source, target, _ = self._points[i]
+            self._points[i] = (source, target, alpha)
+        self.moments += self._point_moments(point_ids)
+
+    def solve(self):
+        """
+        Find the similarity transformation parameters of current points
+        
+        Returns
+        -------
+        lambda_i : float
+            Multiplier factor.
+        r_matrix : numpy.ndarray
+            Rotation matrix.
+        t_vector : numpy.ndarray
+            Translation (column) vector.
+        """
+        if len(self._points) < 2:
+            err_msg = ('There are not two distinct source points.')
+            raise ValueError(err_msg)
+
+        a_matrix, b_scalar, b_matrix, c_scalar, c_matrix = (
+            _get_abc_from_moments(self.moments))
+
+        # Warm start from the previous multiplier factor
+        lambda_i = self.lambda_i if self.scale else self.lambda_0
+
+        blc_matrix, d_matrix, beta_1, r_quat, lambda_i, i = _get_solution(
+                                                                a_matrix,
+                                                                b_scalar,
+                                                                b_matrix,
+                                                                c_scalar,
+                                                                c_matrix,
+                                                                self.scale,
+                                                                lambda_i,
+                                                                1)
+        self.lambda_i = lambda_i
+
+        r_matrix = _get_r_matrix(r_quat)
+
+        s_quat = _get_s_quat(c_scalar, blc_matrix, r_quat)
+
+        t_vector = np.array(_get_t_vector(r_quat, s_quat)).reshape(3,1)
+
+        return lambda_i, r_matrix, t_vector
+
+
+# ==============
+# Apply function
+# ==============
+
+def apply(lambda_i,
+          r_matrix,
+          t_vector,
+          points,
+          out=None,
+          chunk_size=1000000,
+          n_threads=None):
+    """
+    Transform points with similarity transformation parameters
+    
+    Computes ``M * R * XYZ + T`` for each point, chunk by chunk, without
+    transposed copies of the points. Points can be a `numpy.memmap`
+    array, and the result can be written to a preallocated array or
+    `numpy.memmap`, so memory is bounded by the chunks in process.
+    
+    Parameters
+    ----------
+    lambda_i : float
+        Multiplier factor.
+    r_matrix : array_like
+        Rotation matrix, with shape ``(3, 3)``.
+    t_vector : array_like
+        Translation vector, with shape ``(3, 1)`` or ``(3,)``.
+    points : array_like
+        Points to transform, with shape ``(N, 3)``.
+    out : numpy.ndarray, optional
+        Array (or `numpy.memmap`) with shape ``(N, 3)`` to write the
+        transformed points. If not provided, a new array is created.
+        It can be `points` itself to transform in place.
+    chunk_size : int, optional
+        Number of points transformed at a time. Default is 1000000.
+    n_threads : int, optional
+        If provided, transform the chunks in a pool of `n_threads`
+        threads. Default is None.
+
+    Returns
+    -------
+    out : numpy.ndarray
+        Transformed points, with shape ``(N, 3)``.
+    """
+    
+    
+    # declarations and checkups
+
+    points = np.asarray(points)
+
+    if points.ndim != 2 or points.shape[1] != 3:
+        err_msg = ('points array must have shape (N, 3).')
+        raise ValueError(err_msg)
+
+    if out is None:
+        out = np.empty(points.shape)
+    elif out.shape != points.shape:
+        err_msg = ('out array must have the same shape as points.')
+        raise ValueError(err_msg)
+
+    chunk_size = int(chunk_size)
+
+    if chunk_size < 1:
+        err_msg = ('chunk_size must be greater than zero.')
+        raise ValueError(err_msg)
+
+
+    # processes
+
+    # Row points are transformed as XYZ @ (M * R).T + T
+    mr_t_matrix = (lambda_i * np.asarray(r_matrix, dtype=float)).T
+    t_row = np.asarray(t_vector, dtype=float).reshape(3)
+
+    def apply_chunk(start):
+        chunk = np.asarray(points[start:start+chunk_size], dtype=float)
+        out_chunk = out[start:start+chunk_size]
+        np.matmul(chunk, mr_t_matrix, out=out_chunk)
+        out_chunk += t_row
+
+    starts = range(0, points.shape[0], chunk_size)
+
+    if n_threads is None:
+        for start in starts:
+            apply_chunk(start)
+    else:
+        with ThreadPoolExecutor(max_workers=n_threads) as executor:
+            list(executor.map(apply_chunk, starts))
+
+    return out
+
+
+# ======================
+# Batch process function
+# ======================
+
+def process_batch(source_points,
+                  target_points,
+                  alpha_0=None,
+                  offsets=None,
+                  scale=True,
+                  lambda_0=1.0):
+    """
+    Find similarity transformation parameters for many problems at once
+    
+    Each problem is solved as in `process`, but the A, B and C matrices
+    and the eigenproblems of all the problems are computed together.
+    Only the shapes of the arrays are checked. Degenerate problems
+    (e.g. less than two distinct source points) don't affect the other
+    ones, and their results are NaN when the iteration breaks down.
+    
+    Parameters
+    ----------
+    source_points : array_like
+        Stacked source points with shape ``(k, n, 3)``, where ``k`` is
+        the number of problems and ``n`` the number of points of each one.
+        If `offsets` is provided, ragged source points of all problems
+        with shape ``(N, 3)``.
+    target_points : array_like
+        Target points with the same shape as `source_points`.
+    alpha_0 : array_like, optional
+        Per point weights, with shape ``(k, n)`` or ``(N,)`` if `offsets`
+        is provided.
+    offsets : array_like, optional
+        Start of each problem in the ragged points, and ``N`` at the
+        end, with shape ``(k + 1,)``. Each problem needs at least two
+        points.
+    scale : boolean, optional
+        Allow to find multiplier factors different from lambda_0.
+        Default is True.
+    lambda_0 : float or array_like, optional
+        Multiplier factor to find the first solution, a single value or
+        one per problem with shape ``(k,)``. Default is 1.0.
+        If negative, forces mirroring. Can't be zero.
+
+    Returns
+    -------
+    lambda_i : numpy.ndarray
+        Multiplier factors, with shape ``(k,)``.
+    r_matrix : numpy.ndarray
+        Rotation matrices, with shape ``(k, 3, 3)``.
+    t_vector : numpy.ndarray
+        Translation (column) vectors, with shape ``(k, 3, 1)``.
+    """
+    
+    
+    # declarations and checkups
+
+    source_coords = np.asarray(source_points, dtype=float)
+    target_coords = np.asarray(target_points, dtype=float)
+
+    if offsets is None:
+        if source_coords.ndim != 3 or source_coords.shape[2] != 3:
+            err_msg = ('source_points array must have shape (k, n, 3).')
+            raise ValueError(err_msg)
+        if source_coords.shape[1] < 2:
+            err_msg = ('There are not two source points per problem.')
+            raise ValueError(err_msg)
+    else:
+        if source_coords.ndim != 2 or source_coords.shape[1] != 3:
+            err_msg = ('source_points array must have shape (N, 3).')
+            raise ValueError(err_msg)
+        offsets = np.asarray(offsets, dtype=np.intp)
+        if (offsets.ndim != 1 or offsets.size < 2 or offsets[0] != 0
+                or offsets[-1] != source_coords.shape[0]):
+            err_msg = ('offsets must start with 0 and end with N.')
+            raise ValueError(err_msg)
+        if (np.diff(offsets) < 2).any():
+            err_msg = ('There are not two source points per problem.')
+            raise ValueError(err_msg)
+
+    if target_coords.shape != source_coords.shape:
+        err_msg = ('There are not as many target points as source points.')
+        raise ValueError(err_msg)
+
+    if alpha_0 is None:
+        alpha_0 = np.ones(source_coords.shape[:-1])
+    else:
+        alpha_0 = np.asarray(alpha_0, dtype=float)
+
+    if alpha_0.shape != source_coords.shape[:-1]:
+        err_msg = ('There are not as many alpha_0 coefficients as '
+                   'control points.')
+        raise ValueError(err_msg)
+
+    if (np.asarray(lambda_0) == 0).any():
+        err_msg = ('lambda_0 cannot be zero.')
+        raise ValueError(err_msg)
+
+
+    # processes
+
+    moments = _get_moments(alpha_0, source_coords, target_coords, offsets)
+
+    a_matrix, b_scalar, b_matrix, c_scalar, c_matrix = _get_abc_from_moments(
+                                                                    moments)
+
+    blc_matrix, r_quat, lambda_i = _get_batch_solutions(a_matrix,
+                                                        b_scalar,
+                                                        b_matrix,
+                                                        c_scalar,
+                                                        c_matrix,
+                                                        scale,
+                                                        lambda_0)
+
+    r_matrix, t_vector = _get_batch_rt(c_scalar, blc_matrix, r_quat)
+
+    return lambda_i, r_matrix, t_vector
+
+
+# =======================
+# Robust process function
+# =======================
+
+def ransac(source_points,
+           target_points,
+           threshold,
+           alpha_0=None,
+           scale=True,
+           lambda_0=1.0,
+           n_hypotheses=1000,
+           batch_size=256,
+           n_threads=None,
+           seed=None):
+    """
+    Find similarity transformation parameters robust to outliers
+    
+    Minimal samples of three control points are drawn and solved in
+    batches. Each solution is scored by the number of points whose
+    residual (distance between transformed source and target points) is
+    less than `threshold`, breaking ties by the sum of squared inlier
+    residuals. The best consensus set is then solved again with
+    `process` (and its `alpha_0` weights) and the inliers are updated
+    with the refined solution.
+    
+    Parameters
+    ----------
+    source_points : array_like
+        Source points with shape ``(n, 3)``, with ``n >= 3``.
+    target_points : array_like
+        Target points with shape ``(n, 3)``.
+    threshold : float
+        Max residual of an inlier, in target units.
+    alpha_0 : array_like, optional
+        Per point weights, with shape ``(n,)``, used in the refinement.
+    scale : boolean, optional
+        Allow to find a multiplier factor different from lambda_0.
+        Default is True.
+    lambda_0 : float, optional
+        Multiplier factor to find the first solution. Default is 1.0.
+        If negative, forces mirroring. Can't be zero.
+    n_hypotheses : int, optional
+        Number of minimal samples to solve. Default is 1000.
+    batch_size : int, optional
+        Number of minimal samples solved at once. Default is 256.
+    n_threads : int, optional
+        If provided, solve the batches in a pool of `n_threads` threads.
+        Default is None.
+    seed : int, optional
+        Seed for the random samples. Default is None.
+
+    Returns
+    -------
+    lambda_i : float
+        Multiplier factor.
+    r_matrix : numpy.ndarray
+        Rotation matrix.
+    t_vector : numpy.ndarray
+        Translation (column) vector.
+    inliers : numpy.ndarray
+        Boolean mask of the inlier points, with shape ``(n,)``.
+    """
+    
+    
+    # declarations and checkups
+
+    source_coords = np.array(source_points, dtype=float)
+    target_coords = np.array(target_points, dtype=float)
+
+    if source_coords.ndim != 2 or source_coords.shape[1] != 3:
+        err_msg = ('source_points array must have shape (n, 3).')
+        raise ValueError(err_msg)
+
+    if source_coords.shape[0] < _MIN_SAMPLE:
+        err_msg = (f'There are not {_MIN_SAMPLE} source points.')
+        raise ValueError(err_msg)
+
+    if target_coords.shape != source_coords.shape:
+        err_msg = ('There are not as many target points as source points.')
+        raise ValueError(err_msg)
+
+    if alpha_0 is not None:
+        alpha_0 = np.array(alpha_0, dtype=float)
+
+        if alpha_0.shape != (source_coords.shape[0],):
+            err_msg = ('alpha_0 array must have shape (n,).')
+            raise ValueError(err_msg)
+
+    lambda_0 = float(lambda_0)
+
+    if lambda_0 == 0:
+        err_msg = ('lambda_0 cannot be zero.')
+        raise ValueError(err_msg)
+
+    if n_hypotheses < 1:
+        err_msg = ('n_hypotheses must be at least 1.')
+        raise ValueError(err_msg)
+
+    if batch_size < 1:
+        err_msg = ('batch_size must be at least 1.')
+        raise ValueError(err_msg)
+
+
+    # processes
+
+    batches = [min(batch_size, n_hypotheses - start)
+               for start in range(0, n_hypotheses, batch_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(batches))
+
+    def run_batch(n, seed_seq):
+        return _get_ransac_hypotheses(source_coords,
+                                      target_coords,
+                                      threshold,
+                                      scale,
+                                      lambda_0,
+                                      n,
+                                      np.random.default_rng(seed_seq))
+
+    if n_threads is None:
+        results = list(map(run_batch, batches, seeds))
+    else:
+        with ThreadPoolExecutor(max_workers=n_threads) as executor:
+            results = list(executor.map(run_batch, batches, seeds))
+
+    count, error, sample = min(results, key=lambda res: (-res[0], res[1]))
+
+    if count < _MIN_SAMPLE:
+        err_msg = ('There is no consensus set with enough inliers.')
+        raise ValueError(err_msg)
+
+    # Inliers of the best minimal solution
+    lambda_i, r_matrix, t_vector = process(source_coords[sample],
+                                           target_coords[sample],
+                                           scale=scale,
+                                           lambda_0=lambda_0)
+    residuals = _get_batch_residuals(np.array([lambda_i]),
+                                     r_matrix[None],
+                                     t_vector[None],
+                                     source_coords,
+                                     target_coords)[0]
+    inliers = residuals < threshold
+
+    # Refine with the consensus set
+    lambda_i, r_matrix, t_vector = process(
+        source_coords[inliers],
+        target_coords[inliers],
+        alpha_0=None if alpha_0 is None else alpha_0[inliers],
+        scale=scale,
+        lambda_0=lambda_0)
+    residuals = _get_batch_residuals(np.array([lambda_i]),
+                                     r_matrix[None],
+                                     t_vector[None],
+                                     source_coords,
+                                     target_coords)[0]
+    inliers = residuals < threshold
+
+    return lambda_i, r_matrix, t_vector, inliers
+
+
+# ====================
+# Diagnostics function
+# ====================
+
+def diagnostics(source_points,
+                target_points,
+                alpha_0=None,
+                scale=True,
+                lambda_0=1.0):
+    """
+    Compute residuals and leave-one-out residuals of the control points
+    
+    The leave-one-out solution of each point is found by subtracting
+    its moments from the moments of all the points, and all of them are
+    solved in one batch, instead of calling `process` once per point.
+    A point with a great leave-one-out residual is badly predicted by
+    the other points, so probably is a wrong control point.
+    
+    Parameters
+    ----------
+    source_points : array_like
+        Source points with shape ``(n, 3)``, with ``n >= 4``.
+    target_points : array_like
+        Target points with shape ``(n, 3)``.
+    alpha_0 : array_like, optional
+        Per point weights, with shape ``(n,)``.
+    scale : boolean, optional
+        Allow to find a multiplier factor different from lambda_0.
+        Default is True.
+    lambda_0 : float, optional
+        Multiplier factor to find the first solution. Default is 1.0.
+        If negative, forces mirroring. Can't be zero.
+
+    Returns
+    -------
+    residuals : numpy.ndarray
+        Distance between transformed source and target points with the
+        solution of all the points, with shape ``(n,)``.
+    rms : float
+        Root mean square of `residuals`.
+    loo_residuals : numpy.ndarray
+        Distance between transformed source and target points with the
+        solution of all the other points, with shape ``(n,)``.
+    """
+    
+    
+    # declarations and checkups
+
+    source_coords = np.array(source_points, dtype=float)
+    target_coords = np.array(target_points, dtype=float)
+
+    if source_coords.ndim != 2 or source_coords.shape[1] != 3:
+        err_msg = ('source_points array must have shape (n, 3).')
+        raise ValueError(err_msg)
+
+    n = source_coords.shape[0]
+
+    # Each leave-one-out solution needs three points, with two the
+    # rotation about their line is undetermined
+    if n < 4:
+        err_msg = ('There are not four source points.')
+        raise ValueError(err_msg)
+
+    if target_coords.shape != source_coords.shape:
+        err_msg = ('There are not as many target points as source points.')
+        raise ValueError(err_msg)
+
+    if alpha_0 is None:
+        alpha_0 = np.ones(n)
+    else:
+        alpha_0 = np.array(alpha_0, dtype=float)
+
+    if alpha_0.shape != (n,):
+        err_msg = ('There are not as many alpha_0 coefficients as '
+                   'control points.')
+        raise ValueError(err_msg)
+
+
+    # processes
+
+    # Moments of each point, with shape (n, 18)
+    point_moments = _get_moments(alpha_0[:, None],
+                                 source_coords[:, None],
+                                 target_coords[:, None])
+
+    moments = point_moments.sum(0)
+
+    lambda_i, r_matrix, t_vector = process_moments(moments,
+                                                   scale=scale,
+                                                   lambda_0=lambda_0)
+
+    residuals = _get_batch_residuals(np.array([lambda_i]),
+                                     r_matrix[None],
+                                     t_vector[None],
+                                     source_coords,
+                                     target_coords)[0]
+
+    rms = np.sqrt(np.mean(residuals**2))
+
+    # Leave-one-out solutions start from the solution of all the points
+    loo_lambda, loo_r_matrix, loo_t_vector = process_moments(
+        moments - point_moments,
+        scale=scale,
+        lambda_0=lambda_i if scale else lambda_0)
+
+    loo_transformed = (loo_lambda[:, None]
+                       * np.einsum('kij,kj->ki', loo_r_matrix, source_coords)
+                       + loo_t_vector[:, :, 0])
+
+    loo_residuals = np.sqrt(((loo_transformed - target_coords)**2).sum(1))
+
+    return residuals, rms, loo_residuals
+
+
+# =====================
+# 2-D process functions
+# =====================
+
+def process_2d(source_points,
+               target_points,
+               alpha_0=None,
+               scale=True,
+               lambda_0=1.0):
+    """
+    Find 2-D similarity (Helmert) transformation parameters
+    
+    Closed-form weighted least squares solution with complex numbers,
+    for planar control points. Parameters and returns follow the same
+    conventions as `process`, with 2-D points, so transform coordinates
+    with ``XY_t = M * R * XY_s + T``.
+    
+    Parameters
+    ----------
+    source_points : array_like
+        Source points with shape ``(n, 2)``, with at least two distinct
+        points.
+    target_points : array_like
+        Target points with shape ``(n, 2)``.
+    alpha_0 : array_like, optional
+        Per point weights, with shape ``(n,)``.
+    scale : boolean, optional
+        Allow to find a multiplier factor different from lambda_0.
+        Default is True.
+    lambda_0 : float, optional
+        Multiplier factor if `scale=False`. Default is 1.0.
+        If it is negative, forces mirroring (and `r_matrix` is a
+        reflection). Can't be zero.
+
+    Returns
+    -------
+    lambda_i : float
+        Multiplier factor.
+    r_matrix : numpy.ndarray
+        Rotation (or reflection) matrix, with shape ``(2, 2)``.
+    t_vector : numpy.ndarray
+        Translation (column) vector, with shape ``(2, 1)``.
+    """
+    
+    
+    # declarations and checkups
+
+    source_coords = np.array(source_points, dtype=float)
+    target_coords = np.array(target_points, dtype=float)
+
+    if source_coords.ndim != 2 or source_coords.shape[1] != 2:
+        err_msg = ('source_points array must have shape (n, 2).')
+        raise ValueError(err_msg)
+
+    n = source_coords.shape[0]
+
+    if n < 2 or (source_coords[None,0] == source_coords).all():
+        err_msg = ('There are not two distinct source points.')
+        raise ValueError(err_msg)
+
+    if target_coords.shape != source_coords.shape:
+        err_msg = ('There are not as many target points as source points.')
+        raise ValueError(err_msg)
+
+    if alpha_0 is None:
+        alpha_0 = np.ones(n)
+    else:
+        alpha_0 = np.array(alpha_0, dtype=float)
+
+    if alpha_0.shape != (n,):
+        err_msg = ('There are not as many alpha_0 coefficients as '
+                   'control points.')
+        raise ValueError(err_msg)
+
+    lambda_0 = float(lambda_0)
+
+    if lambda_0 == 0:
+        err_msg = ('lambda_0 cannot be zero.')
+        raise ValueError(err_msg)
+
+
+    # processes
+
+    sums = _get_complex_sums(alpha_0, source_coords, target_coords, lambda_0)
+
+    lambda_i, r_matrix, t_vector = _get_helmert_2d(*sums, scale, lambda_0)
+
+    return float(lambda_i), r_matrix, t_vector
+
+
+def process_2d_batch(source_points,
+                     target_points,
+                     alpha_0=None,
+                     offsets=None,
+                     scale=True,
+                     lambda_0=1.0):
+    """
+    Find 2-D similarity transformation parameters for many problems
+    
+    Batched form of `process_2d`, with the same conventions for stacked
+    or ragged problems as `process_batch`. Only the shapes of the arrays
+    are checked.
+    
+    Parameters
+    ----------
+    source_points : array_like
+        Stacked source points with shape ``(k, n, 2)``, or ragged source
+        points with shape ``(N, 2)`` if `offsets` is provided.
+    target_points : array_like
+        Target points with the same shape as `source_points`.
+    alpha_0 : array_like, optional
+        Per point weights, with shape ``(k, n)`` or ``(N,)``.
+    offsets : array_like, optional
+        Start of each problem in the ragged points, and ``N`` at the
+        end, with shape ``(k + 1,)``.
+    scale : boolean, optional
+        Allow to find multiplier factors different from lambda_0.
+        Default is True.
+    lambda_0 : float, optional
+        Multiplier factor if `scale=False`. Default is 1.0.
+        If it is negative, forces mirroring. Can't be zero.
+
+    Returns
+    -------
+    lambda_i : numpy.ndarray
+        Multiplier factors, with shape ``(k,)``.
+    r_matrix : numpy.ndarray
+        Rotation (or reflection) matrices, with shape ``(k, 2, 2)``.
+    t_vector : numpy.ndarray
+        Translation (column) vectors, with shape ``(k, 2, 1)``.
+    """
+    
+    
+    # declarations and checkups
+
+    source_coords = np.asarray(source_points, dtype=float)
+    target_coords = np.asarray(target_points, dtype=float)
+
+    if offsets is None:
+        if source_coords.ndim != 3 or source_coords.shape[2] != 2:
+            err_msg = ('source_points array must have shape (k, n, 2).')
+            raise ValueError(err_msg)
+    else:
+        if source_coords.ndim != 2 or source_coords.shape[1] != 2:
+            err_msg = ('source_points array must have shape (N, 2).')
+            raise ValueError(err_msg)
+        offsets = np.asarray(offsets, dtype=np.intp)
+        if (offsets.ndim != 1 or offsets.size < 2 or offsets[0] != 0
+                or offsets[-1] != source_coords.shape[0]):
+            err_msg = ('offsets must start with 0 and end with N.')
+            raise ValueError(err_msg)
+        if (np.diff(offsets) < 2).any():
+            err_msg = ('There are not two source points per problem.')
+            raise ValueError(err_msg)
+
+    if target_coords.shape != source_coords.shape:
+        err_msg = ('There are not as many target points as source points.')
+        raise ValueError(err_msg)
+
+    if alpha_0 is None:
+        alpha_0 = np.ones(source_coords.shape[:-1])
+    else:
+        alpha_0 = np.asarray(alpha_0, dtype=float)
+
+    if alpha_0.shape != source_coords.shape[:-1]:
+        err_msg = ('There are not as many alpha_0 coefficients as '
+                   'control points.')
+        raise ValueError(err_msg)
+
+    lambda_0 = float(lambda_0)
+
+    if lambda_0 == 0:
+        err_msg = ('lambda_0 cannot be zero.')
+        raise ValueError(err_msg)
+
+
+    # processes
+
+    sums = _get_complex_sums(alpha_0, source_coords, target_coords, lambda_0,
+                             offsets)
+
+    return _get_helmert_2d(*sums, scale, lambda_0)
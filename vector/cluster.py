@@ -4,15 +4,19 @@ from mochila.vector import vlayers
 
 import os
 
+import numpy as np
 from qgis import processing
 from qgis.analysis import (
     QgsGeometrySnapper)
 from qgis.core import (
     QgsFeature,
+    QgsFeatureRequest,
+    QgsField,
     QgsGeometry,
     QgsProcessing,
     QgsProject,
     QgsVectorLayer)
+from qgis.PyQt.QtCore import QVariant
 
 
 def test_cluster():
@@ -37,3 +41,248 @@ def test_cluster():
     result = processing.run("native:kmeansclustering", params)
 
     return result
+
+
+def test_minibatch_cluster():
+    """Test mini-batch k-means clustering on a memory copy of a layer."""
+
+    utf8_path = os.path.join(pkg_path,'vector','data','points.gpkg')
+
+    baseName = 'points'
+
+    layer = vlayers.get_layer_from_gpkg(utf8_path, baseName)
+
+    # Do not write the clusters to the GeoPackage
+    layer = layer.materialize(QgsFeatureRequest())
+
+    # Number of clusters
+    k = 5
+
+    centroids, sizes = minibatch_kmeans(layer, k, batch_size=100, seed=0)
+
+    plog("centroids =", centroids)
+    plog("sizes =", sizes)
+
+    vlayers.load_layer_to_map(layer)
+
+    return layer
+
+
+#####
+# K-MEANS WITH NUMPY
+#####
+
+def kmeans(xy, k, *, seed=None, max_iter=300, tol=1e-10):
+    """Cluster points coordinates with k-means (Lloyd iterations).
+    -----
+    Params:
+        xy:             ndarray
+                Points coordinates with shape (n, 2).
+        k:              int
+                Number of clusters. If greater than n, n clusters are used.
+        seed:           int (optional, keyword only)
+                Seed for the k-means++ initialization. Defaults to None.
+        max_iter:       int (optional, keyword only)
+                Max number of iterations. Defaults to 300.
+        tol:            float (optional, keyword only)
+                Stop when the squared shift of the centroids is lower.
+                Defaults to 1e-10.
+    -----
+    Returns:
+        labels:         ndarray
+                Cluster of each point, with shape (n,).
+        centroids:      ndarray
+                Centroids of the clusters, with shape (k, 2).
+    """
+
+    xy = np.asarray(xy, dtype=float)
+    k = min(k, len(xy))
+    rng = np.random.default_rng(seed)
+
+    centroids = kmeans_pp(xy, k, rng)
+
+    for _ in range(max_iter):
+        labels = get_nearest_centroid(xy, centroids)
+        new_centroids = get_centroids(xy, labels, centroids)
+        shift = ((new_centroids - centroids)**2).sum()
+        centroids = new_centroids
+        if shift <= tol:
+            break
+
+    labels = get_nearest_centroid(xy, centroids)
+
+    return labels, centroids
+
+
+def kmeans_pp(xy, k, rng):
+    """Choose k initial centroids among the points with k-means++."""
+
+    n = len(xy)
+    idxs = [rng.integers(n)]
+    min_d2 = ((xy - xy[idxs[0]])**2).sum(1)
+
+    for _ in range(1, k):
+        total = min_d2.sum()
+        if total > 0:
+            idx = rng.choice(n, p=min_d2 / total)
+        else:
+            # All points are already centroids (duplicated points)
+            idx = rng.integers(n)
+        idxs.append(idx)
+        min_d2 = np.minimum(min_d2, ((xy - xy[idx])**2).sum(1))
+
+    return xy[idxs].copy()
+
+
+def get_nearest_centroid(xy, centroids, chunk_size=65536):
+    """Get the index of the nearest centroid of each point, by chunks."""
+
+    c2 = (centroids**2).sum(1)
+    labels = np.empty(len(xy), dtype=np.intp)
+
+    for start in range(0, len(xy), chunk_size):
+        chunk = xy[start:start+chunk_size]
+        # Squared distances without the constant |x|^2 term
+        d2 = c2 - 2 * chunk @ centroids.T
+        labels[start:start+chunk_size] = d2.argmin(1)
+
+    return labels
+
+
+def get_centroids(xy, labels, centroids):
+    """Get the centroid of each cluster, keeping the previous if empty."""
+
+    k = len(centroids)
+    counts = np.bincount(labels, minlength=k)
+    sums = np.stack([np.bincount(labels, weights=xy[:, 0], minlength=k),
+                     np.bincount(labels, weights=xy[:, 1], minlength=k)], 1)
+
+    new_centroids = centroids.copy()
+    filled = counts > 0
+    new_centroids[filled] = sums[filled] / counts[filled, None]
+
+    return new_centroids
+
+
+#####
+# MINI-BATCH K-MEANS STREAMING A LAYER
+#####
+
+def minibatch_kmeans(layer, k, *, batch_size=10000, n_epochs=1,
+                     sample_size=100000, seed=None, write=True):
+    """Cluster a points layer with mini-batch k-means, in bounded memory.
+
+    Features are streamed from the provider in batches (coordinates only),
+     so the whole layer is never loaded. Centroids are seeded with k-means++
+     on a uniform random sample, then updated with each batch (Sculley,
+     2010). Finally, CLUSTER_ID and CLUSTER_SIZE fields are written to
+     the layer in bulk (one changeAttributeValues call per batch).
+    -----
+    Params:
+        layer:          QgsVectorLayer
+                Points layer (must not be in edit mode to write).
+        k:              int
+                Number of clusters.
+        batch_size:     int (optional, keyword only)
+                Number of points per batch. Defaults to 10000.
+        n_epochs:       int (optional, keyword only)
+                Number of passes over the layer. Defaults to 1.
+        sample_size:    int (optional, keyword only)
+                Size of the sample for the k-means++ seeding.
+                Defaults to 100000.
+        seed:           int (optional, keyword only)
+                Defaults to None.
+        write:          bool (optional, keyword only)
+                Write the CLUSTER_ID and CLUSTER_SIZE fields. Defaults to True.
+    -----
+    Returns:
+        centroids:      ndarray
+                Centroids of the clusters, with shape (k, 2).
+        sizes:          ndarray
+                Size of each cluster, with shape (k,).
+    """
+
+    rng = np.random.default_rng(seed)
+
+    # Uniform sample of the points: the ones with the lowest random keys
+    sample = np.zeros((0, 2))
+    sample_keys = np.zeros(0)
+    for _, xy in vlayers.iter_points_arrays(layer, batch_size):
+        keys = np.concatenate((sample_keys, rng.random(len(xy))))
+        sample = np.concatenate((sample, xy))
+        if len(keys) > sample_size:
+            keep = np.argpartition(keys, sample_size)[:sample_size]
+            keys, sample = keys[keep], sample[keep]
+        sample_keys = keys
+
+    if len(sample) == 0:
+        plog('There are no points with geometry in the layer.')
+        return None, None
+
+    k = min(k, len(sample))
+    centroids = kmeans_pp(sample, k, rng)
+    sample = None
+
+    # Mini-batch updates: each centroid moves to the running mean of the
+    #  points assigned to it, with a learning rate of 1 / its count
+    counts = np.zeros(k)
+    for _ in range(n_epochs):
+        for _, xy in vlayers.iter_points_arrays(layer, batch_size):
+            labels = get_nearest_centroid(xy, centroids)
+            batch_counts = np.bincount(labels, minlength=k)
+            batch_sums = np.stack([
+                np.bincount(labels, weights=xy[:, 0], minlength=k),
+                np.bincount(labels, weights=xy[:, 1], minlength=k)], 1)
+            counts += batch_counts
+            filled = batch_counts > 0
+            centroids[filled] += (
+                (batch_sums[filled]
+                 - batch_counts[filled, None] * centroids[filled])
+                / counts[filled, None])
+
+    # Cluster sizes with the final centroids
+    sizes = np.zeros(k, dtype=np.int64)
+    for _, xy in vlayers.iter_points_arrays(layer, batch_size):
+        sizes += np.bincount(get_nearest_centroid(xy, centroids), minlength=k)
+
+    if write:
+        _write_clusters(layer, centroids, sizes, batch_size)
+
+    return centroids, sizes
+
+
+def _write_clusters(layer, centroids, sizes, batch_size):
+    """Write CLUSTER_ID and CLUSTER_SIZE fields to a layer, by batches."""
+
+    provider = layer.dataProvider()
+
+    new_fields = [QgsField(name, QVariant.Int)
+                  for name in ('CLUSTER_ID', 'CLUSTER_SIZE')
+                  if layer.fields().indexOf(name) < 0]
+    if new_fields:
+        provider.addAttributes(new_fields)
+        layer.updateFields()
+
+    id_idx = layer.fields().indexOf('CLUSTER_ID')
+    size_idx = layer.fields().indexOf('CLUSTER_SIZE')
+
+    # Collect the fids first and read each batch completely before
+    #  writing it, so no iterator is open on the source while it changes
+    fids_request = QgsFeatureRequest()
+    fids_request.setNoAttributes()
+    fids_request.setFlags(QgsFeatureRequest.NoGeometry)
+    all_fids = [f.id() for f in layer.getFeatures(fids_request)]
+
+    for start in range(0, len(all_fids), batch_size):
+        request = QgsFeatureRequest()
+        request.setNoAttributes()
+        request.setFilterFids(all_fids[start:start + batch_size])
+        fids, xy = vlayers.get_points_array(layer, request)
+        if fids.size == 0:
+            continue
+        labels = get_nearest_centroid(xy, centroids)
+        provider.changeAttributeValues({
+            fid: {id_idx: label, size_idx: size}
+            for fid, label, size in zip(fids.tolist(),
+                                        labels.tolist(),
+                                        sizes[labels].tolist())})
@@ -1,16 +1,21 @@
 # -*- coding: utf-8 -*-
 
+from concurrent.futures import ThreadPoolExecutor
+import math
 from pathlib import PurePath
+from statistics import NormalDist
 
 import numpy as np
-from qgis import processing
+from osgeo import gdal
 from qgis.core import (
+    QgsCoordinateReferenceSystem,
     QgsCoordinateTransformContext,
     QgsGeometry,
     QgsFeatureRequest,
-    QgsProcessing,
-    QgsProcessingContext,
-    QgsProject)
+    QgsProject,
+    QgsSpatialIndex,
+    QgsWkbTypes,
+    NULL)
 
 
 from mochila import plog
@@ -20,8 +25,12 @@ from mochila.vector import vlayers
 #=====
 # RUN
 #=====
-def run(samples, results, attr_name):
-    """Compute the confusion matrix from samples and results."""
+def run(samples, results, attr_name, ci=None):
+    """Compute the confusion matrix from samples and results.
+
+    If ci is 'bootstrap' or 'analytic', also report 95% confidence
+     intervals of accuracy and kappa (see get_confidence_intervals).
+    """
 
     # Verify that samples layer only have two values in "attr_name"
     idx = samples.fields().indexOf(attr_name)
@@ -34,22 +43,8 @@ def run(samples, results, attr_name):
         return
 
 
-    # Reference geometry to analyze intersections
-    context = QgsProcessingContext()
-    params = {
-        'INPUT': results,
-        'OUTPUT': QgsProcessing.TEMPORARY_OUTPUT
-    }
-    dissolve_dict = processing.run(
-        'native:dissolve',
-        params,
-        context=context,
-        is_child_algorithm=True)
-
-    dissolved = context.getMapLayer(dissolve_dict['OUTPUT'])
-    ref_feats = dissolved.getFeatures(QgsFeatureRequest())
-    ref_geom = next(ref_feats).geometry()
-    ref_crs = dissolved.crs()
+    # Reference class of each sample and if it intersects the results
+    reference, intersects = get_sample_intersections(samples, attr_name, results)
 
     # Count all features
     samples_count = vlayers.get_features_count(samples)
@@ -57,18 +52,16 @@ def run(samples, results, attr_name):
 
 
     #=====
-    # Create layers for first (1) and second (2) predicted values,
-    #  evaluate the intersection (a) or not (b) with reference geom
-    #  and count features
+    # Count samples with first (1) and second (2) values,
+    #  that intersect (a) or not (b) the results
     #=====
 
 
     # LYR1
-    lyr1 = request_by_attribute(samples, attr_name, values[0])
-    lyr1_count = vlayers.get_features_count(lyr1)
+    lyr1 = reference == values[0]
+    lyr1_count = int(lyr1.sum())
 
-    lyr1a = request_by_intersection(lyr1, ref_geom, ref_crs)
-    lyr1a_count = vlayers.get_features_count(lyr1a)
+    lyr1a_count = int((lyr1 & intersects).sum())
     lyr1b_count = lyr1_count - lyr1a_count
 
     msg = f'Cantidad total de muestras con "{attr_name}" = {values[0]}: '
@@ -78,12 +71,11 @@ def run(samples, results, attr_name):
     msg += f'**{lyr1b_count}** NO intersecan con la capa de resultados.'
     plog(msg)
 
-    # LYR1
-    lyr2 = request_by_attribute(samples, attr_name, values[1])
-    lyr2_count = vlayers.get_features_count(lyr2)
+    # LYR2
+    lyr2 = reference == values[1]
+    lyr2_count = int(lyr2.sum())
 
-    lyr2a = request_by_intersection(lyr2, ref_geom, ref_crs)
-    lyr2a_count = vlayers.get_features_count(lyr2a)
+    lyr2a_count = int((lyr2 & intersects).sum())
     lyr2b_count = lyr2_count - lyr2a_count
 
     msg = f'Cantidad total de muestras con "{attr_name}" = {values[1]}: '
@@ -139,34 +131,635 @@ def run(samples, results, attr_name):
     k = (acc - P_e) / (1 - P_e)
     plog("Cohen's kappa coefficient:", round(k, 5))
 
+    if ci is not None:
+        _log_confidence_intervals(cm, ci)
+
 
 #=====
-# REQUEST BY ATTRIBUTE
+# GET SAMPLE INTERSECTIONS
 #=====
-def request_by_attribute(layer, attr_name, attr_value):
-    """Request the features with attr_value and geom intersection."""
+def get_sample_intersections(samples, attr_name, results, result_attr=None):
+    """Get the class of each sample and the results polygon it intersects.
+
+    Result polygons are indexed with a QgsSpatialIndex, and each sample is
+     tested only against the candidate polygons of its bounding box, with
+     prepared geometries. Nothing is dissolved.
+    -----
+    Params:
+        samples:        QgsVectorLayer
+                Samples layer.
+        attr_name:      str
+                Name of the attribute with the reference class.
+        results:        QgsVectorLayer
+                Results (polygons) layer.
+        result_attr:    str (optional)
+                Name of the attribute with the predicted class in results.
+                Defaults to None.
+    -----
+    Returns:
+        reference:      ndarray
+                Reference class of each sample.
+        predicted:      ndarray
+                If result_attr is None, if each sample intersects the results
+                 (bool). If not, the predicted class of the first results
+                 polygon that intersects each sample (None if any).
+    """
+
+    # Index the results (bulk loaded), storing their geometries
+    res_req = QgsFeatureRequest()
+    res_req.setSubsetOfAttributes([])
+    index = QgsSpatialIndex(
+        results.getFeatures(res_req),
+        flags=QgsSpatialIndex.FlagStoreFeatureGeometries)
+
+    classes = {}
+    if result_attr is not None:
+        res_req = QgsFeatureRequest()
+        res_req.setFlags(QgsFeatureRequest.NoGeometry)
+        res_req.setSubsetOfAttributes([result_attr], results.fields())
+        classes = {f.id(): f[result_attr] for f in results.getFeatures(res_req)}
+
+    # Prepared geometry engines, created when a polygon is a candidate.
+    #  The engine doesn't own the geometry, so keep both.
+    engines = {}
+
+    def get_engine(fid):
+        if fid not in engines:
+            geom = index.geometry(fid)
+            engine = QgsGeometry.createGeometryEngine(geom.constGet())
+            engine.prepareGeometry()
+            engines[fid] = (geom, engine)
+        return engines[fid][1]
+
+    # Samples in the results CRS
+    context = QgsProject.instance().transformContext()
     req = QgsFeatureRequest()
-    req.setFilterExpression(f'"{attr_name}" = \'{attr_value}\'')
+    req.setSubsetOfAttributes([attr_name], samples.fields())
+    req.setDestinationCrs(results.crs(), context)
+
+    reference = []
+    predicted = []
+    for f in samples.getFeatures(req):
+        reference.append(f[attr_name])
+        match = None
+        if f.hasGeometry():
+            geom = f.geometry()
+            for fid in index.intersects(geom.boundingBox()):
+                if get_engine(fid).intersects(geom.constGet()):
+                    match = fid
+                    break
+        if result_attr is None:
+            predicted.append(match is not None)
+        else:
+            predicted.append(None if match is None else classes[match])
+
+    return np.array(reference), np.array(predicted)
+
 
-    requested_layer = layer.materialize(req)
+#=====
+# RUN MULTICLASS
+#=====
+def run_multiclass(samples, attr_name, pred_name, ci=None):
+    """Compute the N-class confusion matrix from reference and predicted attributes.
+    -----
+    Params:
+        samples:        QgsVectorLayer
+                Samples layer.
+        attr_name:      str
+                Name of the attribute with the reference class.
+        pred_name:      str
+                Name of the attribute with the predicted class.
+        ci:             str (optional)
+                If 'bootstrap' or 'analytic', also report 95% confidence
+                 intervals of accuracy and kappa.
+                Defaults to None.
+    -----
+    Returns:
+        cm:             ndarray
+                Confusion matrix, with predicted classes in rows and
+                 reference classes in columns.
+        classes:        ndarray
+                Classes of the rows and columns of cm.
+    """
+
+    reference, predicted = get_sample_classes(samples, attr_name, pred_name)
+    plog("Cantidad total de muestras =", len(reference))
+
+    cm, classes = get_confusion_matrix(reference, predicted)
+    plog("Classes:", classes)
+    plog("Confusion matrix (rows: predicted, columns: reference):\n", cm)
+
+    acc, producers, users, k = get_accuracy_metrics(cm)
+    plog("Accuracy:", round(acc, 5))
+    plog("Producer's accuracy:", np.round(producers, 5))
+    plog("User's accuracy:", np.round(users, 5))
+    plog("Cohen's kappa coefficient:", round(k, 5))
+
+    if ci is not None:
+        _log_confidence_intervals(cm, ci)
 
-    return requested_layer
+    return cm, classes
 
 
 #=====
-# REQUEST BY INTERSECTION
+# GET SAMPLE CLASSES
 #=====
-def request_by_intersection(layer, geom, crs):
-    """Request the features with attr_value and geom intersection."""
-    context = QgsProject.instance().transformContext()
+def get_sample_classes(samples, attr_name, pred_name):
+    """Get reference and predicted classes of all samples in one iteration.
+
+    Samples with NULL reference or predicted class are skipped.
+    """
+
+    fields = samples.fields()
+    attr_idx = fields.indexOf(attr_name)
+    pred_idx = fields.indexOf(pred_name)
+
+    req = QgsFeatureRequest()
+    req.setFlags(QgsFeatureRequest.NoGeometry)
+    req.setSubsetOfAttributes([attr_idx, pred_idx])
+
+    reference = []
+    predicted = []
+    skipped = 0
+    for f in samples.getFeatures(req):
+        ref_value = f.attribute(attr_idx)
+        pred_value = f.attribute(pred_idx)
+        if ref_value == NULL or pred_value == NULL:
+            skipped += 1
+            continue
+        reference.append(ref_value)
+        predicted.append(pred_value)
+
+    if skipped:
+        plog(f'{skipped} muestras con valores NULL fueron descartadas.')
+
+    return np.array(reference), np.array(predicted)
+
+
+#=====
+# GET CONFUSION MATRIX
+#=====
+def get_confusion_matrix(reference, predicted, classes=None):
+    """Build the N-class confusion matrix from class arrays.
+    -----
+    Params:
+        reference:      array_like
+                Reference class of each sample.
+        predicted:      array_like
+                Predicted class of each sample.
+        classes:        array_like (optional)
+                Classes, in the order of the matrix rows and columns.
+                Defaults to the sorted unique values of both arrays.
+    -----
+    Returns:
+        cm:             ndarray
+                Confusion matrix with shape (N, N), with predicted classes
+                 in rows and reference classes in columns.
+        classes:        ndarray
+    """
+
+    reference = np.asarray(reference)
+    predicted = np.asarray(predicted)
+
+    if classes is None:
+        classes = np.unique(np.concatenate((reference, predicted)))
+    else:
+        classes = np.asarray(classes)
+
+    ref_idx = _get_class_indices(classes, reference)
+    pred_idx = _get_class_indices(classes, predicted)
+
+    n = len(classes)
+    cm = np.bincount(pred_idx * n + ref_idx, minlength=n*n).reshape(n, n)
+
+    return cm, classes
+
+
+def _get_class_indices(classes, values):
+    """Get the index in classes of each value."""
+
+    sorter = np.argsort(classes)
+    pos = np.searchsorted(classes, values, sorter=sorter)
+    idx = sorter[np.minimum(pos, len(classes) - 1)]
+
+    if len(values) and not (classes[idx] == values).all():
+        raise ValueError('There are values not present in classes.')
+
+    return idx
+
+
+#=====
+# GET ACCURACY METRICS
+#=====
+def get_accuracy_metrics(cm):
+    """Compute accuracy metrics from a confusion matrix.
+    -----
+    Params:
+        cm:             ndarray
+                Confusion matrix with shape (N, N), with predicted classes
+                 in rows and reference classes in columns.
+    -----
+    Returns:
+        acc:            float
+                Overall accuracy.
+        producers:      ndarray
+                Producer's accuracy of each class (NaN if no reference
+                 samples).
+        users:          ndarray
+                User's accuracy of each class (NaN if no predicted samples).
+        k:              float
+                Cohen's kappa coefficient.
+    """
+
+    cm = np.asarray(cm, dtype=float)
+    total = cm.sum()
+    diag = np.diag(cm)
+    pred_totals = cm.sum(1)
+    ref_totals = cm.sum(0)
+
+    acc = diag.sum() / total
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        producers = diag / ref_totals
+        users = diag / pred_totals
+
+    P_e = (pred_totals * ref_totals).sum() / total**2
+
+    k = (acc - P_e) / (1 - P_e)
+
+    return acc, producers, users, k
+
+
+#=====
+# RUN RASTER
+#=====
+def run_raster(samples, attr_name, utf8_path, band=1, class_map=None):
+    """Compute the N-class confusion matrix from samples and a classified raster.
+
+    See get_raster_classes for parameters.
+    """
+
+    reference, predicted = get_raster_classes(samples, attr_name, utf8_path,
+                                              band, class_map)
+    plog("Cantidad total de muestras =", len(reference))
+
+    cm, classes = get_confusion_matrix(reference, predicted)
+    plog("Classes:", classes)
+    plog("Confusion matrix (rows: predicted, columns: reference):\n", cm)
+
+    acc, producers, users, k = get_accuracy_metrics(cm)
+    plog("Accuracy:", round(acc, 5))
+    plog("Producer's accuracy:", np.round(producers, 5))
+    plog("User's accuracy:", np.round(users, 5))
+    plog("Cohen's kappa coefficient:", round(k, 5))
+
+    return cm, classes
 
+
+#=====
+# GET RASTER CLASSES
+#=====
+def get_raster_classes(samples, attr_name, utf8_path, band=1, class_map=None):
+    """Get reference classes of samples and predicted classes from a raster.
+
+    All sample coordinates are converted to pixel indices at once, and only
+     the raster blocks with samples are read, once each. Samples outside the
+     raster, on nodata pixels or with NULL reference class are skipped.
+    -----
+    Params:
+        samples:        QgsVectorLayer
+                Samples (points) layer. Other geometries are sampled at
+                 their centroid.
+        attr_name:      str
+                Name of the attribute with the reference class.
+        utf8_path:      str
+                Path to the classified raster file.
+        band:           int (optional)
+                Band with the classes. Defaults to 1.
+        class_map:      dict (optional)
+                Map from raster values to classes comparable with the
+                 reference ones (e.g. {1: 'forest', 2: 'water'}).
+                Defaults to None (raster values are the classes).
+                Raises ValueError if a sampled value is not mapped.
+    -----
+    Returns:
+        reference:      ndarray
+                Reference class of each sample.
+        predicted:      ndarray
+                Predicted class of each sample.
+    """
+
+    ds = gdal.Open(utf8_path, gdal.GA_ReadOnly)
+    if not ds:
+        raise Exception(f"Can't open {utf8_path} as a GDAL dataset.")
+
+    rb = ds.GetRasterBand(band)
+    nodata = rb.GetNoDataValue()
+    block_cols, block_rows = rb.GetBlockSize()
+
+    # Sample coordinates in the raster CRS
+    crs = QgsCoordinateReferenceSystem.fromWkt(ds.GetProjection())
+    context = QgsProject.instance().transformContext()
     req = QgsFeatureRequest()
-    req.setDistanceWithin(geometry=geom, distance=0)
+    req.setSubsetOfAttributes([attr_name], samples.fields())
     req.setDestinationCrs(crs, context)
 
-    requested_layer = layer.materialize(req)
+    reference = []
+    coords = []
+    for f in samples.getFeatures(req):
+        ref_value = f[attr_name]
+        if ref_value == NULL or not f.hasGeometry():
+            continue
+        geom = f.geometry()
+        if geom.isMultipart() or geom.type() != QgsWkbTypes.PointGeometry:
+            geom = geom.centroid()
+        point = geom.asPoint()
+        reference.append(ref_value)
+        coords.append((point.x(), point.y()))
+
+    reference = np.array(reference)
+    coords = np.array(coords, dtype=float).reshape(-1, 2)
+
+    # Pixel indices of all samples
+    inv_gt = gdal.InvGeoTransform(ds.GetGeoTransform())
+    x, y = coords.T
+    cols = np.floor(inv_gt[0] + inv_gt[1] * x + inv_gt[2] * y).astype(int)
+    rows = np.floor(inv_gt[3] + inv_gt[4] * x + inv_gt[5] * y).astype(int)
+
+    inside = ((cols >= 0) & (cols < ds.RasterXSize)
+              & (rows >= 0) & (rows < ds.RasterYSize))
+
+    # Read each block with samples once
+    values = np.zeros(len(reference), dtype=float)
+    valid = inside.copy()
+    block_ids = (rows // block_rows) * ((ds.RasterXSize - 1) // block_cols + 1)
+    block_ids += cols // block_cols
+    sample_idxs = np.flatnonzero(inside)
+    order = sample_idxs[np.argsort(block_ids[sample_idxs], kind='stable')]
+    bounds = np.flatnonzero(np.diff(block_ids[order])) + 1
+    for group in np.split(order, bounds):
+        if group.size == 0:
+            continue
+        xoff = cols[group[0]] // block_cols * block_cols
+        yoff = rows[group[0]] // block_rows * block_rows
+        win_xsize = min(block_cols, ds.RasterXSize - xoff)
+        win_ysize = min(block_rows, ds.RasterYSize - yoff)
+        block = rb.ReadAsArray(xoff, yoff, win_xsize, win_ysize)
+        values[group] = block[rows[group] - yoff, cols[group] - xoff]
+
+    # NaN is never a class (and NaN != NaN, so compare it with isnan)
+    valid &= ~np.isnan(values)
+    if nodata is not None and not math.isnan(nodata):
+        valid &= values != nodata
+
+    rb = None
+    ds = None
+
+    skipped = len(reference) - int(valid.sum())
+    if skipped:
+        plog(f'{skipped} muestras fuera del raster o en nodata fueron descartadas.')
+
+    reference = reference[valid]
+    predicted = values[valid]
+    if np.all(predicted == np.round(predicted)):
+        predicted = predicted.astype(np.int64)
+
+    if class_map is not None:
+        raster_values = predicted.tolist()
+        unmapped = sorted(set(raster_values) - class_map.keys())
+        if unmapped:
+            raise ValueError(f'Raster values not present in class_map: '
+                             f'{unmapped}.')
+        predicted = np.array([class_map[v] for v in raster_values])
+
+    return reference, predicted
+
+
+#=====
+# RUN AREAS
+#=====
+def run_areas(reference, ref_attr, classified, class_attr, *,
+              tile_size=None, n_threads=None):
+    """Compute the area-weighted confusion matrix of two polygon layers.
+
+    See get_area_matrix for parameters.
+    """
+
+    areas, classes = get_area_matrix(reference, ref_attr, classified,
+                                     class_attr, tile_size=tile_size,
+                                     n_threads=n_threads)
+    plog("Classes:", classes)
+    plog("Area matrix (rows: classified, columns: reference):\n", areas)
+
+    acc, producers, users, k = get_accuracy_metrics(areas)
+    plog("Area-weighted accuracy:", round(acc, 5))
+    plog("Producer's accuracy:", np.round(producers, 5))
+    plog("User's accuracy:", np.round(users, 5))
+    plog("Cohen's kappa coefficient:", round(k, 5))
+
+    return areas, classes
+
+
+#=====
+# GET AREA MATRIX
+#=====
+def get_area_matrix(reference, ref_attr, classified, class_attr, *,
+                    tile_size=None, n_threads=None):
+    """Accumulate the intersection areas of reference and classified polygons.
+
+    Classified polygons are indexed with a QgsSpatialIndex, and each
+     reference polygon is intersected only with its candidates (with a
+     prepared geometry). Areas are planar, in units of the classified
+     layer CRS. Areas not covered by both layers are not counted.
+    -----
+    Params:
+        reference:      QgsVectorLayer
+                Reference polygons layer.
+        ref_attr:       str
+                Name of the attribute with the reference class.
+        classified:     QgsVectorLayer
+                Classified polygons layer.
+        class_attr:     str
+                Name of the attribute with the classified class.
+        tile_size:      float (optional, keyword only)
+                Side of the square tiles that partition the extent, in
+                 units of the classified layer CRS. Each reference polygon
+                 belongs to the tile of its bounding box center, and each
+                 tile is processed as a task.
+                Defaults to None (one tile).
+        n_threads:      int (optional, keyword only)
+                If provided, process the tiles in a pool of n_threads
+                 threads.
+                Defaults to None.
+    -----
+    Returns:
+        areas:          ndarray
+                Area matrix with shape (N, N), with classified classes
+                 in rows and reference classes in columns.
+        classes:        ndarray
+                Classes of the rows and columns of areas.
+    """
+
+    # Index the classified polygons (bulk loaded), storing their geometries
+    req = QgsFeatureRequest()
+    req.setSubsetOfAttributes([])
+    index = QgsSpatialIndex(
+        classified.getFeatures(req),
+        flags=QgsSpatialIndex.FlagStoreFeatureGeometries)
+
+    req = QgsFeatureRequest()
+    req.setFlags(QgsFeatureRequest.NoGeometry)
+    req.setSubsetOfAttributes([class_attr], classified.fields())
+    predicted = {f.id(): f[class_attr] for f in classified.getFeatures(req)}
+
+    # Reference polygons in the classified CRS
+    context = QgsProject.instance().transformContext()
+    req = QgsFeatureRequest()
+    req.setSubsetOfAttributes([ref_attr], reference.fields())
+    req.setDestinationCrs(classified.crs(), context)
+    ref_items = [(f.geometry(), f[ref_attr])
+                 for f in reference.getFeatures(req) if f.hasGeometry()]
+
+    values = {v for _, v in ref_items} | set(predicted.values())
+    classes = np.array(sorted(v for v in values if v != NULL))
+    class_idx = {v: i for i, v in enumerate(classes.tolist())}
+
+    # Partition the reference polygons by tiles
+    tiles = {}
+    for geom, ref_value in ref_items:
+        if tile_size is None:
+            key = None
+        else:
+            center = geom.boundingBox().center()
+            key = (math.floor(center.x() / tile_size),
+                   math.floor(center.y() / tile_size))
+        tiles.setdefault(key, []).append((geom, ref_value))
+
+    def tile_areas(items):
+        return _get_tile_areas(items, index, predicted, class_idx)
+
+    if n_threads is None:
+        partial_areas = [tile_areas(items) for items in tiles.values()]
+    else:
+        with ThreadPoolExecutor(max_workers=n_threads) as executor:
+            partial_areas = list(executor.map(tile_areas, tiles.values()))
+
+    areas = np.zeros((len(classes), len(classes)))
+    for partial in partial_areas:
+        areas += partial
+
+    return areas, classes
+
+
+def _get_tile_areas(ref_items, index, predicted, class_idx):
+    """Accumulate the intersection areas of the reference polygons of a tile."""
+
+    n = len(class_idx)
+    areas = np.zeros((n, n))
+
+    for geom, ref_value in ref_items:
+        ref_i = class_idx.get(ref_value)
+        if ref_i is None:
+            continue
+
+        engine = QgsGeometry.createGeometryEngine(geom.constGet())
+        engine.prepareGeometry()
+
+        for fid in index.intersects(geom.boundingBox()):
+            pred_i = class_idx.get(predicted[fid])
+            if pred_i is None:
+                continue
+            candidate = index.geometry(fid)
+            if not engine.intersects(candidate.constGet()):
+                continue
+            intersection = engine.intersection(candidate.constGet())
+            if intersection is not None:
+                areas[pred_i, ref_i] += intersection.area()
+
+    return areas
+
+
+#=====
+# GET CONFIDENCE INTERVALS
+#=====
+def get_confidence_intervals(cm, method='bootstrap', level=0.95, *,
+                             n_boot=10000, seed=None):
+    """Compute confidence intervals of accuracy and kappa.
+    -----
+    Params:
+        cm:             ndarray
+                Confusion matrix with shape (N, N).
+        method:         str (optional)
+                'bootstrap': percentile intervals of n_boot replicates.
+                    Resampling n samples with replacement is the same as
+                    drawing the counts of the N*N cells from a multinomial
+                    distribution, so all the replicate matrices are drawn
+                    at once, without resampling the samples.
+                'analytic': normal approximation intervals.
+                Defaults to 'bootstrap'.
+        level:          float (optional)
+                Confidence level. Defaults to 0.95.
+        n_boot:         int (optional, keyword only)
+                Number of bootstrap replicates. Defaults to 10000.
+        seed:           int (optional, keyword only)
+                Seed for the bootstrap replicates. Defaults to None.
+    -----
+    Returns:
+        acc_ci:         ndarray
+                Lower and upper bounds of the overall accuracy.
+        k_ci:           ndarray
+                Lower and upper bounds of Cohen's kappa coefficient.
+    """
+
+    cm = np.asarray(cm)
+    n = int(cm.sum())
+
+    if method == 'bootstrap':
+        rng = np.random.default_rng(seed)
+        # Replicate matrices with shape (n_boot, N, N)
+        cms = rng.multinomial(n, cm.ravel() / n, size=n_boot).reshape(
+            (n_boot,) + cm.shape)
+        accs, ks = _get_batch_accuracy_kappa(cms)
+        q = 100 * np.array([(1 - level) / 2, (1 + level) / 2])
+        acc_ci = np.percentile(accs, q)
+        k_ci = np.nanpercentile(ks, q)
+
+    elif method == 'analytic':
+        acc, ks = _get_batch_accuracy_kappa(cm[None])
+        acc, k = acc[0], ks[0]
+        P_e = (cm.sum(0) * cm.sum(1)).sum() / n**2
+        z = NormalDist().inv_cdf((1 + level) / 2)
+        acc_se = np.sqrt(acc * (1 - acc) / n)
+        k_se = np.sqrt(acc * (1 - acc) / (n * (1 - P_e)**2))
+        acc_ci = np.array([acc - z * acc_se, acc + z * acc_se])
+        k_ci = np.array([k - z * k_se, k + z * k_se])
+
+    else:
+        raise ValueError(f'Unknown method "{method}".')
+
+    return acc_ci, k_ci
+
+
+def _get_batch_accuracy_kappa(cms):
+    """Compute accuracy and kappa of stacked (B, N, N) confusion matrices."""
+
+    cms = np.asarray(cms, dtype=float)
+    totals = cms.sum((1, 2))
+    accs = np.trace(cms, axis1=1, axis2=2) / totals
+    P_e = (cms.sum(1) * cms.sum(2)).sum(1) / totals**2
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ks = (accs - P_e) / (1 - P_e)
+
+    return accs, ks
+
+
+def _log_confidence_intervals(cm, method):
+    """Log the confidence intervals of accuracy and kappa."""
 
-    return requested_layer
+    acc_ci, k_ci = get_confidence_intervals(cm, method)
+    plog(f"Accuracy 95% CI ({method}):", np.round(acc_ci, 5))
+    plog(f"Cohen's kappa coefficient 95% CI ({method}):", np.round(k_ci, 5))
 
 
 #=====
@@ -6,12 +6,18 @@ from mochila.vector import (
 
 import os
 
+import numpy as np
 from qgis import processing
 from qgis.core import (
     QgsGeometry,
     QgsFeature,
+    QgsFeatureRequest,
+    QgsField,
+    QgsFields,
+    QgsMemoryProviderUtils,
     QgsProcessing,
     QgsVectorLayer)
+from qgis.PyQt.QtCore import QVariant
 
 
 #####
@@ -105,6 +111,305 @@ def run(layer, k):
     plog("resluts =", results)
 
 
+#####
+# NUMPY RUN
+#####
+
+def run_array(layer, k, *, seed=None, add_to_map=True):
+    """Extract spatial distributed k points from a points layer, in memory.
+
+    Same result as run (the point closest to the centroid of each k-means
+     cluster, with CLUSTER_ID and CLUSTER_SIZE fields), but the coordinates
+     are read once to a numpy array and processed without temporary layers.
+     If k is greater than the number of points, all points are returned.
+    """
+
+    fids, xy = vlayers.get_points_array(layer)
+
+    if len(fids) == 0:
+        plog('There are no points with geometry in the layer.')
+        return None
+
+    if k > len(fids):
+        plog(f'k = {k} is greater than the {len(fids)} points with '
+             f'geometry, k = {len(fids)} is used.')
+        k = len(fids)
+
+    labels, centroids = cluster.kmeans(xy, k, seed=seed)
+
+    selected, sizes = get_nearest_to_centroids(xy, labels, centroids)
+
+    result_layer = create_selection_layer(
+        layer,
+        fids[selected],
+        {'CLUSTER_ID': labels[selected], 'CLUSTER_SIZE': sizes},
+        baseName='distant_kpoints')
+
+    if add_to_map:
+        vlayers.load_layer_to_map(
+            mapLayer=result_layer)
+
+    return result_layer
+
+
+def get_nearest_to_centroids(xy, labels, centroids):
+    """Get the index of the point closest to the centroid of each cluster.
+    -----
+    Returns:
+        selected:       ndarray
+                Index of the selected point of each non empty cluster.
+        sizes:          ndarray
+                Size of the cluster of each selected point.
+    """
+
+    d2 = ((xy - centroids[labels])**2).sum(1)
+
+    # Sort by label and distance, the first of each label is the closest
+    order = np.lexsort((d2, labels))
+    cluster_ids, first = np.unique(labels[order], return_index=True)
+    selected = order[first]
+
+    sizes = np.bincount(labels, minlength=len(centroids))[cluster_ids]
+
+    return selected, sizes
+
+
+def create_selection_layer(layer, fids, columns, baseName):
+    """Create a memory layer with some features of a layer and new columns.
+    -----
+    Params:
+        layer:          QgsVectorLayer
+                Source layer.
+        fids:           array_like
+                Ids of the features to copy.
+        columns:        dict
+                New integer fields as {'field_name': array_like}, with a
+                 value for each feature in fids.
+        baseName:       str
+                Name of the new layer.
+    -----
+    Returns:
+        new_layer:      QgsVectorLayer
+    """
+
+    fields = QgsFields(layer.fields())
+    for name in columns:
+        fields.append(QgsField(name, QVariant.Int))
+
+    new_layer = QgsMemoryProviderUtils.createMemoryLayer(
+        baseName,
+        fields,
+        layer.wkbType(),
+        layer.crs())
+
+    fids = [int(fid) for fid in fids]
+    values = dict(zip(fids, zip(*(np.asarray(v).tolist()
+                                  for v in columns.values()))))
+
+    req = QgsFeatureRequest()
+    req.setFilterFids(fids)
+
+    flist = []
+    for f in layer.getFeatures(req):
+        feature = QgsFeature(fields)
+        feature.setGeometry(f.geometry())
+        feature.setAttributes(f.attributes() + list(values[f.id()]))
+        flist.append(feature)
+
+    new_layer.dataProvider().addFeatures(flist)
+    new_layer.updateExtents()
+
+    return new_layer
+
+
+#####
+# FARTHEST POINT SAMPLING RUN
+#####
+
+def run_fps(layer, k, *, seed=None, start_fids=None, approximate=False,
+            cell_size=None, add_to_map=True):
+    """Extract spatial distributed k points with farthest point sampling.
+
+    Each new point is the farthest one from the points already selected
+     (maximin sampling). The output layer is the same kind as the one of
+     run: CLUSTER_ID is the selection order and CLUSTER_SIZE the number
+     of points closest to each selected point.
+    -----
+    Params:
+        layer:          QgsVectorLayer
+                Points layer.
+        k:              int
+                Number of points to extract (all if greater than n).
+        seed:           int (optional, keyword only)
+                Seed to choose the first point at random. Defaults to None.
+        start_fids:     list (optional, keyword only)
+                Ids of features to start with (selected first), instead
+                 of a random one. Defaults to None.
+        approximate:    bool (optional, keyword only)
+                Bucket the points in a grid and sample the cells, each one
+                 represented by its point closest to the cell mean. For
+                 tens of millions of points. Defaults to False.
+        cell_size:      float (optional, keyword only)
+                Side of the grid cells. Defaults to a size that gives
+                 about 100 cells per extracted point.
+        add_to_map:     bool (optional, keyword only)
+                Defaults to True.
+    -----
+    Returns:
+        result_layer:   QgsVectorLayer
+    """
+
+    fids, xy = vlayers.get_points_array(layer)
+
+    if len(fids) == 0:
+        plog('There are no points with geometry in the layer.')
+        return None
+
+    k = min(k, len(fids))
+
+    start = None
+    if start_fids is not None:
+        start = np.flatnonzero(np.isin(fids, start_fids))
+
+    rng = np.random.default_rng(seed)
+
+    if approximate:
+        selected, labels = grid_farthest_point_sampling(
+            xy, k, rng, start=start, cell_size=cell_size)
+    else:
+        selected, labels = farthest_point_sampling(xy, k, rng, start=start)
+
+    if len(selected) < k:
+        plog(f'There are only {len(selected)} distinct locations, '
+             f'{len(selected)} points were extracted.')
+
+    sizes = np.bincount(labels, minlength=len(selected))
+
+    result_layer = create_selection_layer(
+        layer,
+        fids[selected],
+        {'CLUSTER_ID': np.arange(len(selected)), 'CLUSTER_SIZE': sizes},
+        baseName='distant_kpoints')
+
+    if add_to_map:
+        vlayers.load_layer_to_map(
+            mapLayer=result_layer)
+
+    return result_layer
+
+
+def farthest_point_sampling(xy, k, rng, start=None):
+    """Select k points by farthest point sampling, O(n*k).
+    -----
+    Params:
+        xy:             ndarray
+                Points coordinates with shape (n, 2).
+        k:              int
+                Number of points to select (k <= n).
+        rng:            numpy.random.Generator
+                Generator to choose the first point if start is None.
+        start:          array_like (optional)
+                Indices of the points selected first. Defaults to None.
+    -----
+    Returns:
+        selected:       ndarray
+                Indices of the selected points, in selection order. Less
+                 than k if there are less than k distinct locations.
+        labels:         ndarray
+                Position in selected of the closest selected point to
+                 each point, with shape (n,).
+    """
+
+    n = len(xy)
+    if start is None or len(start) == 0:
+        start = [rng.integers(n)]
+    selected = list(start)[:k]
+
+    # Min squared distance to the selected points, and the closest one
+    min_d2 = np.full(n, np.inf)
+    labels = np.zeros(n, dtype=np.intp)
+
+    def update(label, idx):
+        d2 = ((xy - xy[idx])**2).sum(1)
+        closer = d2 < min_d2
+        min_d2[closer] = d2[closer]
+        labels[closer] = label
+
+    for label, idx in enumerate(selected):
+        update(label, idx)
+
+    while len(selected) < k:
+        idx = int(min_d2.argmax())
+        # There are less than k distinct locations: all are covered
+        if min_d2[idx] == 0:
+            break
+        update(len(selected), idx)
+        selected.append(idx)
+
+    return np.array(selected, dtype=np.intp), labels
+
+
+def grid_farthest_point_sampling(xy, k, rng, start=None, cell_size=None):
+    """Approximate farthest point sampling over grid cells representatives.
+
+    Same parameters and returns as farthest_point_sampling, plus the side
+     of the grid cells (cell_size).
+    """
+
+    mins = xy.min(0)
+    spans = xy.max(0) - mins
+    max_span = spans.max()
+
+    # All the points at the same place: nothing to approximate
+    if max_span == 0:
+        return farthest_point_sampling(xy, k, rng, start=start)
+
+    if cell_size is None:
+        area = spans[0] * spans[1]
+        if area > 0:
+            cell_size = np.sqrt(area / (100 * k))
+        else:
+            # Collinear points (horizontal or vertical), cells along them
+            cell_size = max_span / (100 * k)
+    # Keep the cell keys (n_cols * n_rows) within int64
+    cell_size = max(cell_size, max_span / 2**26)
+
+    cells = np.floor((xy - mins) / cell_size).astype(np.int64)
+    n_cols = cells[:, 0].max() + 1
+    keys = cells[:, 1] * n_cols + cells[:, 0]
+    _, cell_idx = np.unique(keys, return_inverse=True)
+    n_cells = cell_idx.max() + 1
+
+    # Representative of each cell: the point closest to the cell mean
+    counts = np.bincount(cell_idx, minlength=n_cells)
+    means = np.stack([
+        np.bincount(cell_idx, weights=xy[:, 0], minlength=n_cells),
+        np.bincount(cell_idx, weights=xy[:, 1], minlength=n_cells)],
+        1) / counts[:, None]
+    d2 = ((xy - means[cell_idx])**2).sum(1)
+    order = np.lexsort((d2, cell_idx))
+    reps = order[np.unique(cell_idx[order], return_index=True)[1]]
+
+    # Start points are kept, with the representatives of the other cells
+    if start is not None and len(start):
+        start = np.asarray(start)
+        others = reps[~np.isin(np.arange(n_cells), cell_idx[start])]
+        reps = np.concatenate((start, others))
+        rep_start = np.arange(len(start))
+    else:
+        rep_start = None
+
+    rep_selected, rep_labels = farthest_point_sampling(
+        xy[reps], min(k, len(reps)), rng, start=rep_start)
+
+    # Points take the label of their cell representative (or start point)
+    rep_of_cell = np.empty(n_cells, dtype=np.intp)
+    rep_of_cell[cell_idx[reps[::-1]]] = np.arange(len(reps))[::-1]
+    labels = rep_labels[rep_of_cell[cell_idx]]
+
+    return reps[rep_selected], labels
+
+
 #####
 # SIMPLE TEST WITH A GEOPACKAGE LAYER
 #####
@@ -130,6 +435,35 @@ def test():
 def test_k_gt_n():
     """Test if k value is greater than n features in layer"""
 
+    layer = _create_k_gt_n_layer()
+
+    k = 5
+
+    run(layer, k)
+
+
+#####
+# TEST THE NUMPY RUN
+#####
+
+def test_array():
+    """Test the run_array function with a layer and k values"""
+
+    utf8_path = os.path.join(pkg_path,'vector','data','points.gpkg')
+
+    baseName = 'points'
+
+    layer = vlayers.get_layer_from_gpkg(utf8_path, baseName)
+
+    run_array(layer, 5)
+
+    # K value greater than n features
+    run_array(_create_k_gt_n_layer(), 5)
+
+
+def _create_k_gt_n_layer():
+    """Create a memory layer with 4 points"""
+
     layer = QgsVectorLayer(
         path='Point',
         baseName='point',
@@ -152,7 +486,4 @@ def test_k_gt_n():
     layer.dataProvider().addFeatures(
         flist)
 
-    k = 5
-
-    run(layer, k)
-
+    return layer
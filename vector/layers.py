@@ -1,40 +1,21 @@
 # -*- coding: utf-8 -*-
-from mochila import plog
+from mochila.vector import vlayers
 
 import os
 
 
-from osgeo import ogr
 from qgis.analysis import QgsGeometrySnapper
 
 from qgis.core import (
     QgsFeatureSource,
-    QgsProject,
-    QgsVectorLayer)
+    QgsProject)
 
 
 def get_layer_from_gpkg(utf8_path, baseName):
     """Get a QgsVectorLayer from a GeoPackage file path and layer name"""
-    layer = None
 
-    datasource = ogr.Open(
-        utf8_path)
-
-    layer_names = [l.GetName() for l in datasource]
-
-    # QGIS ogr provider path to the layer
-    path = utf8_path + "|layername=" + baseName
-    provider = 'ogr'
-
-    if baseName in layer_names:
-        layer = QgsVectorLayer(
-            path,
-            baseName,
-            provider)
-    else:
-        plog(f'Error: there is no layer named "{baseName}" in {utf8_path}')
-
-    datasource = None
+    # Share the GeoPackage catalog and datasources pool of vlayers
+    layer = vlayers.get_layer_from_gpkg(utf8_path, baseName)
 
     return layer
 
@@ -1,16 +1,33 @@
 # -*- coding: utf-8 -*-
 from mochila import plog
+from mochila.vector import vlayers
 
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import math
+import os
+import sys
 
+from osgeo import ogr, osr
 from qgis.core import (
+    NULL,
     QgsFeature,
+    QgsFeatureRequest,
     QgsGeometry,
+    QgsMemoryProviderUtils,
     QgsProcessing,
     QgsProject,
     QgsVectorLayer)
+from qgis.PyQt.QtCore import (
+    QDate,
+    QDateTime,
+    QTime,
+    QVariant,
+    Qt)
 
-from mochila.utils import numpy_utils
+from mochila.utils import (
+    geom_arrays,
+    numpy_utils)
 
 
 def run(geom, threshold):
@@ -39,6 +56,298 @@ def run(geom, threshold):
     return geom
 
 
+#####
+# ARRAY BASED RUN
+#####
+
+def run_geometry(geom, threshold):
+    """Remove spikes from a (multi)polygon with the arrays engine.
+    -----
+    Params:
+        geom:           QgsGeometry
+                Polygon or MultiPolygon geometry (not modified).
+        threshold:      float
+                Max angle of a spike, in degrees.
+    -----
+    Returns:
+        new_geom:       QgsGeometry
+                Geometry without spikes, of the same type.
+        n_removed:      int
+                Number of removed vertices.
+    """
+
+    wkb, n_removed = geom_arrays.remove_wkb_spikes(
+        bytes(geom.asWkb()),
+        threshold)
+
+    new_geom = QgsGeometry()
+    new_geom.fromWkb(wkb)
+
+    return new_geom, n_removed
+
+
+def run_layer(layer, threshold, *, baseName='Without spikes',
+              add_to_map=True):
+    """Remove spikes from every feature of a polygons layer.
+
+    Ring angles are computed at once with numpy for each ring, and spikes
+     are removed iteratively until there are none. Holes and parts left
+     with less than three vertices are dropped.
+    -----
+    Params:
+        layer:          QgsVectorLayer
+                Polygons layer (not modified).
+        threshold:      float
+                Max angle of a spike, in degrees.
+        baseName:       str
+                Name of the new layer.
+        add_to_map:     bool
+                Add the new layer to the project.
+    -----
+    Returns:
+        new_layer:      QgsVectorLayer
+                Memory layer with the same fields and the new geometries.
+    """
+
+    new_layer = QgsMemoryProviderUtils.createMemoryLayer(
+        baseName,
+        layer.fields(),
+        layer.wkbType(),
+        layer.crs())
+
+    n_removed = 0
+    skipped = 0
+
+    flist = []
+    for f in layer.getFeatures(QgsFeatureRequest()):
+        feature = QgsFeature(f)
+        geom = f.geometry()
+        if not geom.isNull():
+            try:
+                new_geom, removed = run_geometry(geom, threshold)
+            except ValueError:
+                # Curved or non polygon geometries are kept as they are
+                skipped += 1
+            else:
+                feature.setGeometry(new_geom)
+                n_removed += removed
+        flist.append(feature)
+
+    new_layer.dataProvider().addFeatures(flist)
+    new_layer.updateExtents()
+
+    plog(f"Deleted {n_removed} vertices from {len(flist)} features "
+         f"({skipped} features skipped).")
+
+    if add_to_map:
+        QgsProject.instance().addMapLayer(new_layer)
+
+    return new_layer
+
+
+#####
+# PARALLEL RUN TO GEOPACKAGE
+#####
+
+# Workers can't import the mochila package (puentes runs it), and a
+#  generic 'utils' package elsewhere in sys.path could shadow ours, so
+#  geom_arrays is loaded by file path under this unique name
+_WORKER_MODULE = 'mochila_geom_arrays'
+
+_WORKER_LOADER = '''
+import importlib.util
+import sys
+spec = importlib.util.spec_from_file_location({name!r}, {path!r})
+module = importlib.util.module_from_spec(spec)
+sys.modules[{name!r}] = module
+spec.loader.exec_module(module)
+'''
+
+_OGR_FIELD_TYPES = {
+    QVariant.Bool: ogr.OFTInteger,
+    QVariant.Int: ogr.OFTInteger,
+    QVariant.UInt: ogr.OFTInteger64,
+    QVariant.LongLong: ogr.OFTInteger64,
+    QVariant.ULongLong: ogr.OFTInteger64,
+    QVariant.Double: ogr.OFTReal,
+    QVariant.Date: ogr.OFTDate,
+    QVariant.Time: ogr.OFTTime,
+    QVariant.DateTime: ogr.OFTDateTime}
+
+
+def run_layer_parallel(layer, threshold, utf8_path, *,
+                       baseName='without_spikes', chunk_size=10000,
+                       n_workers=None, mp_context=None, add_to_map=False):
+    """Remove spikes from every feature of a polygons layer, in parallel.
+
+    Features are read as WKB in chunks (in the main thread) and cleaned
+     in a pool of processes with the numpy engine of geom_arrays, which
+     doesn't use QGIS objects. Each cleaned chunk is written to the
+     GeoPackage in its own transaction, in the source order.
+    -----
+    Params:
+        layer:          QgsVectorLayer
+                Polygons layer (not modified).
+        threshold:      float
+                Max angle of a spike, in degrees.
+        utf8_path:      str
+                Path of the GeoPackage file (created if it doesn't exist).
+        baseName:       str (optional, keyword only)
+                Name of the new layer (overwritten if it exists).
+        chunk_size:     int (optional, keyword only)
+                Number of features per chunk (and per transaction).
+        n_workers:      int (optional, keyword only)
+                Number of processes. Defaults to the number of CPUs.
+        mp_context:     multiprocessing context (optional, keyword only)
+                Context of the processes pool. On Windows, QGIS executable
+                 is not a python interpreter, so call
+                 multiprocessing.set_executable with the path of QGIS
+                 python (pythonw.exe) before.
+        add_to_map:     bool (optional, keyword only)
+                Add the new layer to the project.
+    -----
+    Returns:
+        new_layer:      QgsVectorLayer
+    """
+
+    # The same code loads the worker module here and in each process
+    #  (exec is a builtin, so it can be sent to the processes)
+    loader = _WORKER_LOADER.format(name=_WORKER_MODULE,
+                                   path=geom_arrays.__file__)
+    if _WORKER_MODULE not in sys.modules:
+        exec(loader, {})
+    worker = sys.modules[_WORKER_MODULE].remove_wkbs_spikes
+
+    n_workers = n_workers or os.cpu_count()
+
+    datasource, ogr_layer, field_idxs = _create_gpkg_layer(
+        layer, utf8_path, baseName)
+
+    totals = [0, 0, 0]
+    pending = deque()
+
+    with ProcessPoolExecutor(max_workers=n_workers,
+                             mp_context=mp_context,
+                             initializer=exec,
+                             initargs=(loader, {})) as executor:
+        for fids, wkbs, rows in _iter_wkb_chunks(layer, field_idxs,
+                                                 chunk_size):
+            pending.append(
+                (executor.submit(worker, wkbs, threshold), fids, rows))
+            # Keep a few chunks per worker in memory, write the oldest one
+            while len(pending) > 2 * n_workers:
+                _write_chunk(datasource, ogr_layer, *pending.popleft(), totals)
+        while pending:
+            _write_chunk(datasource, ogr_layer, *pending.popleft(), totals)
+
+    ogr_layer = None
+    datasource = None
+
+    n_features, n_removed, n_skipped = totals
+    plog(f"Deleted {n_removed} vertices from {n_features} features "
+         f"({n_skipped} features skipped).")
+
+    new_layer = vlayers.get_layer_from_gpkg(utf8_path, baseName)
+
+    if add_to_map:
+        vlayers.load_layer_to_map(new_layer)
+
+    return new_layer
+
+
+def _iter_wkb_chunks(layer, field_idxs, chunk_size):
+    """Yield (fids, wkbs, rows) chunks with the ids, geometries and
+     attributes."""
+
+    fids = []
+    wkbs = []
+    rows = []
+    for f in layer.getFeatures(QgsFeatureRequest()):
+        fids.append(f.id())
+        geom = f.geometry()
+        wkbs.append(None if geom.isNull() else bytes(geom.asWkb()))
+        attrs = f.attributes()
+        rows.append([attrs[i] for i in field_idxs])
+        if len(wkbs) == chunk_size:
+            yield fids, wkbs, rows
+            fids = []
+            wkbs = []
+            rows = []
+
+    if wkbs:
+        yield fids, wkbs, rows
+
+
+def _create_gpkg_layer(layer, utf8_path, baseName):
+    """Create a GeoPackage layer with the fields and CRS of a layer."""
+
+    if os.path.exists(utf8_path):
+        datasource = ogr.Open(utf8_path, 1)
+    else:
+        datasource = ogr.GetDriverByName('GPKG').CreateDataSource(utf8_path)
+
+    if datasource is None:
+        raise Exception(f"Can't open {utf8_path} as a GeoPackage.")
+
+    spat_ref = osr.SpatialReference()
+    spat_ref.SetFromUserInput(layer.crs().toWkt())
+    spat_ref.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+
+    ogr_layer = datasource.CreateLayer(
+        baseName,
+        spat_ref,
+        int(layer.wkbType()),
+        options=['OVERWRITE=YES'])
+
+    # Source feature ids are kept as FIDs (see _write_chunk), so the fid
+    #  field of a GeoPackage source is not a field of the new layer
+    fid_column = ogr_layer.GetFIDColumn()
+
+    field_idxs = []
+    for i, field in enumerate(layer.fields()):
+        if field.name() == fid_column:
+            continue
+        field_defn = ogr.FieldDefn(
+            field.name(),
+            _OGR_FIELD_TYPES.get(field.type(), ogr.OFTString))
+        if field.type() == QVariant.Bool:
+            field_defn.SetSubType(ogr.OFSTBoolean)
+        ogr_layer.CreateField(field_defn)
+        field_idxs.append(i)
+
+    return datasource, ogr_layer, field_idxs
+
+
+def _write_chunk(datasource, ogr_layer, future, fids, rows, totals):
+    """Write a cleaned chunk in a single transaction, keeping the fids."""
+
+    wkbs, n_removed, n_skipped = future.result()
+
+    defn = ogr_layer.GetLayerDefn()
+
+    datasource.StartTransaction()
+    for fid, wkb, values in zip(fids, wkbs, rows):
+        feature = ogr.Feature(defn)
+        feature.SetFID(fid)
+        for i, value in enumerate(values):
+            if value == NULL:
+                feature.SetFieldNull(i)
+            elif isinstance(value, (QDate, QDateTime, QTime)):
+                feature.SetField(i, value.toString(Qt.ISODate))
+            elif isinstance(value, bool):
+                feature.SetField(i, int(value))
+            else:
+                feature.SetField(i, value)
+        if wkb is not None:
+            feature.SetGeometryDirectly(ogr.CreateGeometryFromWkb(wkb))
+        ogr_layer.CreateFeature(feature)
+    datasource.CommitTransaction()
+
+    totals[0] += len(wkbs)
+    totals[1] += n_removed
+    totals[2] += n_skipped
+
+
 
 def test():
 
@@ -94,4 +403,28 @@ def test():
         layer)
 
 
+def test_layer():
+
+    wkt = "Multipolygon("
+    wkt += "((0 0, 10 0, 10 10, 9.9 5, 0 10, 0 0),(1 1, 2 1, 2 2, 1 2, 1.5 1.9, 1 1)),"
+    wkt += "((15 0, 20 0, 16 0.1, 20 0.2, 20 1, 19.9 0.3, 19 1, 20 5, 15 5, 15 0))"
+    wkt += ")"
+
+    layer = QgsVectorLayer(
+        path='MultiPolygon',
+        baseName='With spikes',
+        providerLib='memory')
+
+    feature = QgsFeature(
+        id=0)
+
+    feature.setGeometry(
+        QgsGeometry.fromWkt(wkt))
+
+    layer.dataProvider().addFeatures(
+        [feature])
+
+    QgsProject.instance().addMapLayer(
+        layer)
 
+    run_layer(layer, 15)
@@ -1,13 +1,20 @@
 # -*- coding: utf-8 -*-
 from mochila import plog
+from mochila.vector import vlayers
 
+from concurrent.futures import ThreadPoolExecutor
+import math
+import threading
 
 from qgis.analysis import (
     QgsGeometrySnapper
 )
 from qgis.core import (
     QgsFeature,
+    QgsFeatureRequest,
+    QgsFields,
     QgsGeometry,
+    QgsMemoryProviderUtils,
     QgsVectorLayer
 )
 
@@ -82,3 +89,219 @@ def test_geometry_snapper():
 
     return result
 
+
+#=====
+# BATCH SNAPPING
+#=====
+def get_snap_mode(mode):
+    """Get a QgsGeometrySnapper.SnapMode from a snapper_modes name or value"""
+
+    if isinstance(mode, str):
+        if mode not in snapper_modes:
+            raise ValueError(f'Unknown snapper mode "{mode}", use one of '
+                             f'{list(snapper_modes)}.')
+        mode = snapper_modes[mode]
+
+    return QgsGeometrySnapper.SnapMode(mode)
+
+
+def create_reference_snapshot(reference, request=None):
+    """Copy the reference geometries to a read-only memory layer.
+
+    The snapshot doesn't change while snapping (even if the reference
+     layer is edited) and can be read from several threads.
+    -----
+    Params:
+        reference:      QgsVectorLayer
+                Reference layer to snap to.
+        request:        QgsFeatureRequest (optional)
+                Request to filter the reference features.
+    -----
+    Returns:
+        snapshot:       QgsVectorLayer
+                Memory layer with the reference geometries, no attributes.
+    """
+
+    request = QgsFeatureRequest(request or QgsFeatureRequest())
+    request.setSubsetOfAttributes([])
+
+    snapshot = QgsMemoryProviderUtils.createMemoryLayer(
+        'reference_snapshot',
+        QgsFields(),
+        reference.wkbType(),
+        reference.crs())
+
+    flist = []
+    for f in reference.getFeatures(request):
+        if f.hasGeometry():
+            feature = QgsFeature()
+            feature.setGeometry(f.geometry())
+            flist.append(feature)
+
+    snapshot.dataProvider().addFeatures(flist)
+    snapshot.updateExtents()
+
+    return snapshot
+
+
+def snap_layer(layer, reference, snapTolerance, mode='PreferNodes', *,
+               n_threads=None, chunk_size=10000, in_place=False,
+               baseName='snapped', add_to_map=False):
+    """Snap every feature of a layer to a reference layer.
+
+    The snapper (and its reference spatial index) is built once, over a
+     snapshot of the reference geometries. With n_threads, each thread
+     builds its own snapper over the same snapshot the first time it's
+     used, and the features are snapped in chunks.
+    -----
+    Params:
+        layer:          QgsVectorLayer
+                Layer with the geometries to snap.
+        reference:      QgsVectorLayer
+                Reference layer to snap to.
+        snapTolerance:  float
+                Snap tolerance, in layer units.
+        mode:           str or int (optional)
+                One of the snapper_modes names or values.
+                Defaults to 'PreferNodes'.
+        n_threads:      int (optional, keyword only)
+                Number of threads. Defaults to None (no threads).
+        chunk_size:     int (optional, keyword only)
+                Number of features snapped and written at once.
+        in_place:       bool (optional, keyword only)
+                Change the geometries of the layer (through its provider)
+                 instead of creating a new memory layer.
+        baseName:       str (optional, keyword only)
+                Name of the new layer.
+        add_to_map:     bool (optional, keyword only)
+                Add the new layer to the project.
+    -----
+    Returns:
+        new_layer:      QgsVectorLayer
+                The new memory layer, or layer if in_place.
+    """
+
+    mode = get_snap_mode(mode)
+
+    # Keep the snapshot referenced while the snappers use it
+    snapshot = create_reference_snapshot(reference)
+
+    # The layer can only be read from the main thread, its provider's
+    #  getFeatures is thread-safe
+    snapshot_source = snapshot.dataProvider()
+
+    local = threading.local()
+
+    def snap_geoms(geoms):
+        snapper = getattr(local, 'snapper', None)
+        if snapper is None:
+            snapper = local.snapper = QgsGeometrySnapper(snapshot_source)
+        return [snapper.snapGeometry(geom, snapTolerance, mode)
+                for geom in geoms]
+
+    if in_place:
+        new_layer = layer
+    else:
+        new_layer = QgsMemoryProviderUtils.createMemoryLayer(
+            baseName,
+            layer.fields(),
+            layer.wkbType(),
+            layer.crs())
+
+    provider = new_layer.dataProvider()
+
+    def write(features):
+        snappable = [f for f in features if f.hasGeometry()]
+        geoms = [f.geometry() for f in snappable]
+
+        if executor is None:
+            snapped = snap_geoms(geoms)
+        else:
+            # One contiguous slice per thread, to keep the order
+            step = max(1, math.ceil(len(geoms) / n_threads))
+            slices = [geoms[i:i + step] for i in range(0, len(geoms), step)]
+            snapped = [g for part in executor.map(snap_geoms, slices)
+                       for g in part]
+
+        if in_place:
+            provider.changeGeometryValues(
+                {f.id(): geom for f, geom in zip(snappable, snapped)})
+        else:
+            for f, geom in zip(snappable, snapped):
+                f.setGeometry(geom)
+            provider.addFeatures(features)
+
+    executor = None
+    if n_threads is not None and n_threads > 1:
+        executor = ThreadPoolExecutor(max_workers=n_threads)
+
+    # Collect the fids first and read each chunk completely before
+    #  writing it, so no iterator is open on the layer while it changes
+    fids_request = QgsFeatureRequest()
+    fids_request.setNoAttributes()
+    fids_request.setFlags(QgsFeatureRequest.NoGeometry)
+    fids = [f.id() for f in layer.getFeatures(fids_request)]
+
+    n_features = 0
+    try:
+        for start in range(0, len(fids), chunk_size):
+            request = QgsFeatureRequest()
+            request.setFilterFids(fids[start:start + chunk_size])
+            if in_place:
+                request.setNoAttributes()
+            features = list(layer.getFeatures(request))
+            write(features)
+            n_features += len(features)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    new_layer.updateExtents()
+    if in_place:
+        new_layer.triggerRepaint()
+
+    plog(f"Snapped {n_features} features of {layer.name()}.")
+
+    if add_to_map and not in_place:
+        vlayers.load_layer_to_map(new_layer)
+
+    return new_layer
+
+
+def test_snap_layer():
+    """Test snap all the features of a layer, with two threads"""
+
+    layer = QgsVectorLayer(
+        path='Polygon',
+        baseName='to snap',
+        providerLib='memory'
+    )
+
+    flist = []
+    for i in range(10):
+        feature = QgsFeature()
+        feature.setGeometry(
+            QgsGeometry.fromWkt(
+                wkt="Polygon((0.1 -0.1, 10.1 0, 9.9 10.1, 0 10, 0.1 -0.1))"
+            )
+        )
+        flist.append(feature)
+
+    layer.dataProvider().addFeatures(
+        flist=flist
+    )
+
+    referenceSource = create_scratch_reference_layer()
+
+    result = snap_layer(
+        layer,
+        referenceSource,
+        snapTolerance=1,
+        n_threads=2,
+        chunk_size=4
+    )
+
+    for f in result.getFeatures():
+        plog("result =", f.geometry())
+
+    return result
@@ -0,0 +1,430 @@
+# -*- coding: utf-8 -*-
+from mochila import plog, pkg_path
+from mochila.vector import vlayers
+
+import json
+import os
+import time
+import zipfile
+
+import numpy as np
+from qgis.core import (
+    QgsFeatureRequest,
+    QgsProviderRegistry,
+    QgsSpatialIndex)
+
+
+# Max number of children of each node of the STR-tree
+NODE_CAPACITY = 16
+
+# Extension of the index files, written next to the data
+INDEX_SUFFIX = '.sidx.npz'
+
+# {index_path: (StrTree, key)}, the indexes already loaded in this session
+_index_cache = {}
+
+
+#=====
+# STR-TREE
+#=====
+class StrTree:
+    """Packed (Sort-Tile-Recursive) R-tree of bounding boxes, on arrays.
+
+    The tree is bulk-loaded at once: the boxes are sorted in tiles by the
+     x and y of their centers, grouped in leaf nodes of node_capacity
+     boxes, and the nodes are grouped again up to the root. It's made of
+     numpy arrays only, so it's saved and loaded as a .npz file.
+    -----
+    Params:
+        boxes:          array_like
+                Bounding boxes with shape (n, 4), as xmin, ymin, xmax, ymax.
+        fids:           array_like
+                Feature ids with shape (n,).
+        node_capacity:  int (optional)
+                Max number of children of each node.
+    """
+
+    def __init__(self, boxes, fids, node_capacity=NODE_CAPACITY):
+
+        boxes = np.asarray(boxes, dtype=float).reshape(-1, 4)
+        fids = np.asarray(fids, dtype=np.int64)
+
+        if fids.shape != (boxes.shape[0],):
+            raise ValueError('There are not as many fids as boxes.')
+
+        self.node_capacity = int(node_capacity)
+
+        order = _get_str_order(boxes, self.node_capacity)
+        self.boxes = boxes[order]
+        self.fids = fids[order]
+
+        # levels[0] are the leaf nodes, levels[-1] the root node
+        self.levels = []
+        level_boxes = self.boxes
+        while len(level_boxes) > 0:
+            level_boxes = _get_parent_boxes(level_boxes, self.node_capacity)
+            self.levels.append(level_boxes)
+            if len(level_boxes) == 1:
+                break
+
+    def __len__(self):
+        return len(self.fids)
+
+    @classmethod
+    def from_layer(cls, layer, request=None, node_capacity=NODE_CAPACITY):
+        """Bulk-load a tree with the bounding boxes of a layer features."""
+
+        fids, boxes = get_layer_boxes(layer, request)
+
+        return cls(boxes, fids, node_capacity)
+
+    @classmethod
+    def load(cls, path):
+        """Load a tree saved with save(). Returns (tree, key)."""
+
+        with np.load(path) as data:
+            tree = cls.__new__(cls)
+            tree.node_capacity = int(data['node_capacity'])
+            tree.boxes = data['boxes']
+            tree.fids = data['fids']
+            tree.levels = [data[f'level_{i}']
+                           for i in range(int(data['n_levels']))]
+            key = json.loads(str(data['key']))
+
+        return tree, key
+
+    def save(self, path, key=None):
+        """Save the tree (and a key to validate it later) to a .npz file."""
+
+        levels = {f'level_{i}': level for i, level in enumerate(self.levels)}
+
+        # Write to a temp file and rename, to never leave a partial index
+        tmp_path = path + '.tmp.npz'
+        np.savez(
+            tmp_path,
+            node_capacity=self.node_capacity,
+            boxes=self.boxes,
+            fids=self.fids,
+            n_levels=len(self.levels),
+            key=json.dumps(key),
+            **levels)
+        os.replace(tmp_path, path)
+
+    def intersects(self, rect):
+        """Get the fids of the boxes that intersect a rectangle.
+        -----
+        Params:
+            rect:           QgsRectangle or tuple
+                    Rectangle or (xmin, ymin, xmax, ymax) tuple.
+        -----
+        Returns:
+            fids:           numpy.ndarray
+        """
+
+        xmin, ymin, xmax, ymax = _get_rect_tuple(rect)
+
+        def intersecting(boxes, idxs):
+            b = boxes[idxs]
+            mask = ((b[:, 0] <= xmax) & (b[:, 2] >= xmin)
+                    & (b[:, 1] <= ymax) & (b[:, 3] >= ymin))
+            return idxs[mask]
+
+        idxs = self._walk(intersecting)
+
+        return self.fids[idxs]
+
+    def nearest(self, x, y, k=1):
+        """Get the fids of the k nearest boxes to a point.
+
+        Distances are to the bounding boxes, so they are exact only for
+         points layers.
+        -----
+        Returns:
+            fids:           numpy.ndarray
+                    Up to k fids, from the nearest.
+            dists:          numpy.ndarray
+                    Distances to their boxes.
+        """
+
+        k = min(int(k), len(self))
+        if k < 1:
+            return self.fids[:0], np.zeros(0)
+
+        def candidates(boxes, idxs):
+            min_d, max_d = _get_box_dists(boxes[idxs], x, y)
+            # Every node has a box within max_d, so the k-th smallest
+            #  max_d (one box per node) bounds the k-th nearest distance
+            kth = min(k, len(idxs)) - 1
+            bound = np.partition(max_d, kth)[kth]
+            return idxs[min_d <= bound]
+
+        idxs = self._walk(candidates)
+
+        dists, _ = _get_box_dists(self.boxes[idxs], x, y)
+        first = np.argsort(dists, kind='stable')[:k]
+
+        return self.fids[idxs[first]], dists[first]
+
+    def _walk(self, select):
+        """Walk the tree down from the root, keeping the selected nodes."""
+
+        if not self.levels:
+            return np.zeros(0, dtype=np.int64)
+
+        m = self.node_capacity
+        idxs = np.arange(len(self.levels[-1]))
+        children = self.levels[-2::-1] + [self.boxes]
+        boxes = self.levels[-1]
+        for child_boxes in children:
+            idxs = select(boxes, idxs)
+            idxs = (idxs[:, None] * m + np.arange(m)).ravel()
+            idxs = idxs[idxs < len(child_boxes)]
+            boxes = child_boxes
+
+        return select(boxes, idxs)
+
+
+def _get_str_order(boxes, node_capacity):
+    """Get the Sort-Tile-Recursive order of the boxes."""
+
+    n = len(boxes)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    cx = (boxes[:, 0] + boxes[:, 2]) / 2
+    cy = (boxes[:, 1] + boxes[:, 3]) / 2
+
+    n_leaves = int(np.ceil(n / node_capacity))
+    n_slices = int(np.ceil(np.sqrt(n_leaves)))
+    slice_size = n_slices * node_capacity
+
+    # Sort by x, then by y inside each vertical slice (lexsort: last key
+    #  is the primary one)
+    by_x = np.argsort(cx, kind='stable')
+    slice_ids = np.empty(n, dtype=np.int64)
+    slice_ids[by_x] = np.arange(n) // slice_size
+    order = np.lexsort((cy, slice_ids))
+
+    return order
+
+
+def _get_parent_boxes(boxes, node_capacity):
+    """Get the boxes of the nodes grouping node_capacity consecutive boxes."""
+
+    starts = np.arange(0, len(boxes), node_capacity)
+
+    parents = np.empty((len(starts), 4))
+    parents[:, :2] = np.minimum.reduceat(boxes[:, :2], starts, axis=0)
+    parents[:, 2:] = np.maximum.reduceat(boxes[:, 2:], starts, axis=0)
+
+    return parents
+
+
+def _get_box_dists(boxes, x, y):
+    """Get the min and max distances from a point to some boxes."""
+
+    dx = np.maximum(np.maximum(boxes[:, 0] - x, x - boxes[:, 2]), 0)
+    dy = np.maximum(np.maximum(boxes[:, 1] - y, y - boxes[:, 3]), 0)
+    min_d = np.hypot(dx, dy)
+
+    fx = np.maximum(np.abs(boxes[:, 0] - x), np.abs(boxes[:, 2] - x))
+    fy = np.maximum(np.abs(boxes[:, 1] - y), np.abs(boxes[:, 3] - y))
+    max_d = np.hypot(fx, fy)
+
+    return min_d, max_d
+
+
+def _get_rect_tuple(rect):
+    """Get (xmin, ymin, xmax, ymax) from a QgsRectangle or a tuple."""
+
+    if hasattr(rect, 'xMinimum'):
+        return (rect.xMinimum(), rect.yMinimum(),
+                rect.xMaximum(), rect.yMaximum())
+
+    return tuple(float(v) for v in rect)
+
+
+#=====
+# LAYER BOXES
+#=====
+def get_layer_boxes(layer, request=None):
+    """Get the fids and bounding boxes of the features of a layer.
+    -----
+    Params:
+        layer:          QgsVectorLayer
+        request:        QgsFeatureRequest (optional)
+                Request to filter the features.
+    -----
+    Returns:
+        fids:           numpy.ndarray
+                Feature ids with shape (n,).
+        boxes:          numpy.ndarray
+                Bounding boxes with shape (n, 4), as xmin, ymin, xmax, ymax.
+                 Features without geometry are left out.
+    """
+
+    request = QgsFeatureRequest(request or QgsFeatureRequest())
+    request.setSubsetOfAttributes([])
+
+    fids = []
+    boxes = []
+    for f in layer.getFeatures(request):
+        if not f.hasGeometry():
+            continue
+        bbox = f.geometry().boundingBox()
+        fids.append(f.id())
+        boxes.append((bbox.xMinimum(), bbox.yMinimum(),
+                      bbox.xMaximum(), bbox.yMaximum()))
+
+    return (np.array(fids, dtype=np.int64),
+            np.array(boxes, dtype=float).reshape(-1, 4))
+
+
+#=====
+# QGIS SPATIAL INDEX
+#=====
+def get_qgs_index(layer, request=None, store_geometries=False):
+    """Build a QgsSpatialIndex of a layer with bulk loading.
+
+    Passing the features iterator to the constructor bulk loads the tree,
+     which is much faster than inserting the features one by one.
+    -----
+    Params:
+        layer:          QgsVectorLayer
+        request:        QgsFeatureRequest (optional)
+                Request to filter the features.
+        store_geometries: bool (optional)
+                Store the geometries in the index (see
+                 QgsSpatialIndex.geometry).
+    -----
+    Returns:
+        index:          QgsSpatialIndex
+    """
+
+    request = QgsFeatureRequest(request or QgsFeatureRequest())
+    request.setSubsetOfAttributes([])
+
+    flags = (QgsSpatialIndex.FlagStoreFeatureGeometries if store_geometries
+             else QgsSpatialIndex.Flags())
+
+    index = QgsSpatialIndex(layer.getFeatures(request), flags=flags)
+
+    return index
+
+
+#=====
+# PERSISTENT INDEX
+#=====
+def get_index_key(layer):
+    """Get the key that identifies a version of a file based layer.
+
+    Returns None if the layer isn't file based (or is filtered), so its
+     index can't be saved.
+    """
+
+    if layer.subsetString():
+        return None
+
+    parts = QgsProviderRegistry.instance().decodeUri(
+        layer.providerType(), layer.source())
+    path = parts.get('path')
+    if not path or not os.path.isfile(path):
+        return None
+
+    stat = os.stat(path)
+
+    key = {
+        'path': os.path.abspath(path),
+        'layer': parts.get('layerName') or str(parts.get('layerId') or ''),
+        'mtime_ns': stat.st_mtime_ns,
+        'feature_count': layer.featureCount()}
+
+    return key
+
+
+def get_index_path(key):
+    """Get the path of the index file of a key, next to the data file."""
+
+    name = key['path']
+    if key['layer']:
+        name += '.' + key['layer']
+
+    return name + INDEX_SUFFIX
+
+
+def get_index(layer, *, node_capacity=NODE_CAPACITY, save=True):
+    """Get the STR-tree of a layer, from the cache if it's up to date.
+
+    The tree of a file based layer is saved next to the data file, and
+     loaded again (in a few milliseconds) while the source path, layer
+     name, modification time and features count don't change. Other
+     layers get a new tree each time.
+    -----
+    Params:
+        layer:          QgsVectorLayer
+        node_capacity:  int (optional, keyword only)
+                Max number of children of each node of new trees.
+        save:           bool (optional, keyword only)
+                Save new trees next to the data. Defaults to True.
+    -----
+    Returns:
+        tree:           StrTree
+    """
+
+    key = get_index_key(layer)
+    if key is None:
+        return StrTree.from_layer(layer, node_capacity=node_capacity)
+
+    index_path = get_index_path(key)
+
+    tree, cached_key = _index_cache.get(index_path, (None, None))
+    if tree is not None and cached_key == key:
+        return tree
+
+    if os.path.exists(index_path):
+        try:
+            tree, cached_key = StrTree.load(index_path)
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            plog(f'Error: the index file {index_path} is not valid.')
+            tree, cached_key = None, None
+        if tree is not None and cached_key == key:
+            _index_cache[index_path] = (tree, key)
+            return tree
+
+    tree = StrTree.from_layer(layer, node_capacity=node_capacity)
+    _index_cache[index_path] = (tree, key)
+
+    if save:
+        try:
+            tree.save(index_path, key)
+        except OSError as e:
+            plog(f"Error: can't save the index to {index_path} ({e}).")
+
+    return tree
+
+
+def clear_index_cache():
+    """Clear the indexes loaded in this session (the files are kept)."""
+
+    _index_cache.clear()
+
+
+def test():
+    """Test get the index of a GeoPackage layer twice (built, then loaded)."""
+
+    utf8_path = os.path.join(pkg_path,'vector','data','points.gpkg')
+
+    layer = vlayers.get_layer_from_gpkg(utf8_path, 'points')
+
+    for _ in range(2):
+        clear_index_cache()
+        start = time.perf_counter()
+        tree = get_index(layer)
+        plog(f'Index of {len(tree)} features in '
+             f'{(time.perf_counter() - start) * 1000:.1f} ms.')
+
+    extent = layer.extent()
+    fid, dist = tree.nearest(extent.center().x(), extent.center().y())
+    plog(f'Nearest feature to the center: {fid}, at {dist}.')
+
+    return tree
@@ -1,10 +1,13 @@
 # -*- coding: utf-8 -*-
 from mochila import plog
 
+from concurrent.futures import ThreadPoolExecutor
 import os
+import threading
 
 
-from osgeo import ogr
+import numpy as np
+from osgeo import ogr, osr
 from qgis.analysis import QgsGeometrySnapper
 
 from qgis.core import (
@@ -14,7 +17,9 @@ from qgis.core import (
     QgsGeometry,
     QgsPointXY,
     QgsProject,
-    QgsVectorLayer)
+    QgsProviderRegistry,
+    QgsVectorLayer,
+    QgsWkbTypes)
 from qgis.utils import iface
 
 
@@ -44,10 +49,7 @@ def get_layer_from_gpkg(utf8_path, baseName):
     """Get a QgsVectorLayer from a GeoPackage file path and layer name"""
     layer = None
 
-    datasource = ogr.Open(
-        utf8_path)
-
-    layer_names = [l.GetName() for l in datasource]
+    layer_names = get_gpkg_layer_names(utf8_path)
 
     # QGIS ogr provider path to the layer
     path = utf8_path + "|layername=" + baseName
@@ -61,9 +63,56 @@ def get_layer_from_gpkg(utf8_path, baseName):
     else:
         plog(f'Error: there is no layer named "{baseName}" in {utf8_path}')
 
+    return layer
+
+
+#=====
+# GEOPACKAGE CATALOG
+#=====
+
+# {utf8_path: (file_key, layer_names)}
+_gpkg_catalog = {}
+_gpkg_lock = threading.Lock()
+
+
+def _get_file_key(utf8_path):
+    """Get the modification time and size of a file, to detect changes."""
+    stat = os.stat(utf8_path)
+
+    return stat.st_mtime_ns, stat.st_size
+
+
+def get_gpkg_layer_names(utf8_path):
+    """Get the layer names of a GeoPackage, scanned once per file version.
+
+    Only the names are cached: the datasource is opened for the scan and
+     closed right after, so the file is never kept open.
+    """
+    file_key = _get_file_key(utf8_path)
+
+    with _gpkg_lock:
+        cached = _gpkg_catalog.get(utf8_path)
+    if cached is not None and cached[0] == file_key:
+        return cached[1]
+
+    # Each scan opens its own datasource (OGR datasources are not
+    #  thread-safe)
+    datasource = ogr.Open(utf8_path)
+    if datasource is None:
+        raise Exception(f"Can't open {utf8_path} as an OGR datasource.")
+    layer_names = frozenset(l.GetName() for l in datasource)
     datasource = None
 
-    return layer
+    with _gpkg_lock:
+        _gpkg_catalog[utf8_path] = (file_key, layer_names)
+
+    return layer_names
+
+
+def clear_gpkg_cache():
+    """Clear the GeoPackage catalog."""
+    with _gpkg_lock:
+        _gpkg_catalog.clear()
 
 
 #=====
@@ -84,48 +133,428 @@ def load_layer_to_map(mapLayer):
 def get_features_count(layer):
     """Get the features count of a layer"""
 
-    feats = layer.getFeatures(QgsFeatureRequest())
-    count = len(list(feats))
+    count = count_features(layer)
 
     return count
 
 
+#=====
+# COUNT FEATURES
+#=====
+def count_features(layer, expression=None, rect=None, geometry=None,
+                   distance=0, *, sql_where=None):
+    """Count the features of a layer, optionally filtered, without fetching them.
+    -----
+    Params:
+        layer:          QgsVectorLayer
+                Layer to count the features.
+        expression:     str (optional)
+                Filter expression.
+        rect:           QgsRectangle (optional)
+                Filter rectangle (bounding box intersection), in layer CRS.
+        geometry:       QgsGeometry (optional)
+                Filter geometry, in layer CRS. Features within distance
+                 of the geometry are counted.
+        distance:       float (optional)
+                Distance to the filter geometry. Defaults to 0.
+        sql_where:      str (optional, keyword only)
+                For ogr layers (GeoPackage, Shapefile...) without subset
+                 string, a WHERE clause in the SQL dialect of the source
+                 (e.g. SQLite for GeoPackage), so OGR counts the features
+                 without QGIS. Can be combined with rect (then filtered
+                 by OGR), not with expression or geometry. QGIS
+                 expressions are never passed to OGR, as the same text
+                 can have other meaning in SQL (e.g. LIKE case
+                 sensitivity or integer division).
+    -----
+    Returns:
+        count:          int
+                Features count.
+    """
+
+    if sql_where is not None:
+        if expression is not None or geometry is not None:
+            raise ValueError('sql_where can not be combined with '
+                             'expression or geometry filters.')
+        if layer.providerType() != 'ogr' or layer.subsetString():
+            raise ValueError('sql_where needs an ogr layer without '
+                             'subset string.')
+        count = _count_features_ogr(layer, sql_where, rect)
+        if count is None:
+            raise ValueError(f'Can not count the features of '
+                             f'{layer.name()} where "{sql_where}".')
+        return count
+
+    # No filters: use the count known by the provider
+    if expression is None and rect is None and geometry is None:
+        count = layer.featureCount()
+        if count >= 0:
+            return count
+
+    # Iterate without geometries nor attributes (the ones referenced by
+    #  the expression are fetched anyway)
+    req = QgsFeatureRequest()
+    req.setSubsetOfAttributes([])
+    if expression is not None:
+        req.setFilterExpression(expression)
+    if rect is not None:
+        req.setFilterRect(rect)
+    if geometry is not None:
+        req.setDistanceWithin(geometry, distance)
+    else:
+        req.setFlags(QgsFeatureRequest.NoGeometry)
+
+    count = sum(1 for _ in layer.getFeatures(req))
+
+    return count
+
+
+def _count_features_ogr(layer, where, rect):
+    """Count the features of an ogr layer with OGR SQL, None if not possible."""
+
+    parts = QgsProviderRegistry.instance().decodeUri('ogr', layer.source())
+
+    datasource = ogr.Open(parts['path'])
+    if datasource is None:
+        return None
+
+    if parts.get('layerName'):
+        ogr_layer = datasource.GetLayerByName(parts['layerName'])
+    else:
+        ogr_layer = datasource.GetLayer(parts.get('layerId') or 0)
+    if ogr_layer is None:
+        return None
+
+    if where is not None:
+        try:
+            valid = ogr_layer.SetAttributeFilter(where) == ogr.OGRERR_NONE
+        except RuntimeError:
+            valid = False
+        if not valid:
+            return None
+
+    if rect is not None:
+        ogr_layer.SetSpatialFilterRect(
+            rect.xMinimum(),
+            rect.yMinimum(),
+            rect.xMaximum(),
+            rect.yMaximum())
+
+    count = ogr_layer.GetFeatureCount()
+
+    ogr_layer = None
+    datasource = None
+
+    return count
+
+
+#=====
+# GET POINTS ARRAY
+#=====
+def get_points_array(layer, request=None):
+    """Get the feature ids and points coordinates of a layer as arrays.
+
+    Features without geometry are skipped, and other geometries than
+     points are represented by their centroid.
+    -----
+    Params:
+        layer:          QgsVectorLayer
+                Layer to read.
+        request:        QgsFeatureRequest (optional)
+                Request to filter the features. Defaults to a request
+                 without attributes.
+    -----
+    Returns:
+        fids:           ndarray
+                Feature ids, with shape (n,).
+        xy:             ndarray
+                Points coordinates, with shape (n, 2).
+    """
+
+    chunks = list(iter_points_arrays(layer, request=request))
+
+    fids = np.concatenate([c[0] for c in chunks] or [np.zeros(0, np.int64)])
+    xy = np.concatenate([c[1] for c in chunks] or [np.zeros((0, 2))])
+
+    return fids, xy
+
+
+#=====
+# ITER POINTS ARRAYS
+#=====
+def iter_points_arrays(layer, chunk_size=100000, request=None):
+    """Iterate the feature ids and points coordinates of a layer by chunks.
+
+    Same as get_points_array, but yields (fids, xy) arrays of up to
+     chunk_size features, so memory is bounded.
+    """
+
+    if request is None:
+        request = QgsFeatureRequest()
+        request.setSubsetOfAttributes([])
+
+    fids = []
+    coords = []
+    for f in layer.getFeatures(request):
+        if not f.hasGeometry():
+            continue
+        geom = f.geometry()
+        if geom.isMultipart() or geom.type() != QgsWkbTypes.PointGeometry:
+            geom = geom.centroid()
+        point = geom.asPoint()
+        fids.append(f.id())
+        coords.append((point.x(), point.y()))
+        if len(fids) == chunk_size:
+            yield np.array(fids, dtype=np.int64), np.array(coords, dtype=float)
+            fids = []
+            coords = []
+
+    if fids:
+        yield np.array(fids, dtype=np.int64), np.array(coords, dtype=float)
+
+
 #=====
 # GET REF GEOM
 #=====
-def get_ref_geom(layer):
-    """Get multipart geometry as union of all geometries from a layer."""
+def get_ref_geom(layer, batch_size=256, n_threads=None):
+    """Get multipart geometry as union of all geometries from a layer.
+
+    See get_union_geom for batch_size and n_threads parameters.
+    """
 
-    feats = layer.getFeatures(QgsFeatureRequest())
-    for i, f in enumerate(feats):
-        if i == 0:
-            g = f.geometry()
-        else:
-            g = f.geometry().combine(g)
+    req = QgsFeatureRequest()
+    req.setSubsetOfAttributes([])
+    geoms = [f.geometry() for f in layer.getFeatures(req) if f.hasGeometry()]
+
+    g = get_union_geom(geoms, batch_size, n_threads)
 
     return g
 
 
+#=====
+# GET UNION GEOM
+#=====
+def get_union_geom(geoms, batch_size=256, n_threads=None):
+    """Get the union of geometries with a cascaded (tree-reduced) union.
+    -----
+    Params:
+        geoms:          list
+                List of QgsGeometry objects.
+        batch_size:     int (optional)
+                Number of geometries merged by each unaryUnion call.
+                Geometries are sorted by location, so each batch covers
+                 a compact area, and the partial unions are merged again
+                 in batches until one geometry remains.
+                Defaults to 256.
+        n_threads:      int (optional)
+                If provided, run the unions of each level in a pool of
+                 n_threads threads.
+                Defaults to None.
+    -----
+    Returns:
+        g:              QgsGeometry
+                Union of all geometries (empty if there are no geometries).
+    """
+
+    if batch_size < 2:
+        raise ValueError('batch_size must be greater than 1.')
+
+    geoms = _sort_geoms_by_location(geoms, batch_size)
+
+    executor = None
+    if n_threads is not None:
+        executor = ThreadPoolExecutor(max_workers=n_threads)
+
+    try:
+        while len(geoms) > 1:
+            batches = [geoms[i:i+batch_size]
+                       for i in range(0, len(geoms), batch_size)]
+            if executor is None:
+                geoms = [QgsGeometry.unaryUnion(b) for b in batches]
+            else:
+                geoms = list(executor.map(QgsGeometry.unaryUnion, batches))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    if not geoms:
+        return QgsGeometry()
+
+    return geoms[0]
+
+
+def _sort_geoms_by_location(geoms, batch_size):
+    """Sort geometries by cells of a grid with about one cell per batch."""
+
+    if len(geoms) <= batch_size:
+        return list(geoms)
+
+    centers = np.array([
+        [b.center().x(), b.center().y()]
+        for b in (g.boundingBox() for g in geoms)])
+
+    cells = int(np.ceil(np.sqrt(len(geoms) / batch_size)))
+    mins = centers.min(0)
+    sizes = np.maximum(centers.max(0) - mins, np.finfo(float).tiny)
+    col, row = np.minimum(
+        ((centers - mins) / sizes * cells).astype(int), cells - 1).T
+
+    order = np.lexsort((centers[:, 0], col, row))
+
+    return [geoms[i] for i in order]
+
+
 #=====
 # CREATE POINTS LAYER FROM POINTS COORDINATES AND CRS
 #=====
 def create_layer_from_points(points, crs):
     """Create new memory layer with points and crs."""
 
+    layer = create_points_layer(points, crs, add_to_map=True)
+
+    return layer
+
+
+#=====
+# CREATE POINTS LAYER FROM COORDINATES ARRAYS
+#=====
+
+# Memory provider and OGR field types by numpy dtype kind
+_MEMORY_FIELD_TYPES = {'b': 'boolean', 'i': 'integer64', 'u': 'integer64',
+                       'f': 'double'}
+_OGR_FIELD_TYPES = {'b': ogr.OFTInteger, 'i': ogr.OFTInteger64,
+                    'u': ogr.OFTInteger64, 'f': ogr.OFTReal}
+
+
+def create_points_layer(xy, crs, attributes=None, *, baseName='points',
+                        utf8_path=None, add_to_map=False):
+    """Create a points layer from coordinates arrays, in bulk.
+    -----
+    Params:
+        xy:             array_like
+                Points coordinates with shape (n, 2). Columns after the
+                 second one (e.g. Z) are ignored.
+        crs:            str
+                Coordinate Reference System of the points (e.g. 'EPSG:4326').
+        attributes:     dict (optional)
+                Attribute columns as {'field_name': array_like} with
+                 n values each. Integer, float and boolean arrays are
+                 stored as numbers, any other as strings.
+                An 'id' field with the index of each point is always added.
+        baseName:       str (optional, keyword only)
+                Layer name. Defaults to 'points'.
+        utf8_path:      str (optional, keyword only)
+                If provided, write the points to a layer of this GeoPackage
+                 file (overwritten if it exists) in a single transaction
+                 and load it. If not, create a memory layer.
+        add_to_map:     bool (optional, keyword only)
+                Add the layer to the project. Defaults to False.
+    -----
+    Returns:
+        layer:          QgsVectorLayer
+    """
+
+    xy = np.asarray(xy, dtype=float)
+    if xy.ndim != 2 or xy.shape[1] < 2:
+        raise ValueError('Points must have shape (n, 2) or more columns.')
+    # Extra columns (e.g. Z of ENU vertices) are ignored
+    xy = xy[:, :2]
+    n = xy.shape[0]
+
+    columns = {'id': np.arange(n)}
+    for name, values in (attributes or {}).items():
+        values = np.asarray(values)
+        if values.shape != (n,):
+            raise ValueError(f'Attribute "{name}" has not {n} values.')
+        columns[name] = values
+
+    if utf8_path is None:
+        layer = _create_points_memory_layer(xy, crs, columns, baseName)
+    else:
+        _write_points_gpkg(xy, crs, columns, utf8_path, baseName)
+        layer = get_layer_from_gpkg(utf8_path, baseName)
+
+    if add_to_map:
+        load_layer_to_map(layer)
+
+    return layer
+
+
+def _create_points_memory_layer(xy, crs, columns, baseName):
+    """Create a memory layer and add all the points in one call."""
+
+    path = f'Point?crs={crs}'
+    for name, values in columns.items():
+        field_type = _MEMORY_FIELD_TYPES.get(values.dtype.kind, 'string')
+        path += f'&field={name}:{field_type}'
+
     layer = QgsVectorLayer(
-        path=f'Point?crs={crs}&field=id:integer',
-        baseName='points',
+        path=path,
+        baseName=baseName,
         providerLib='memory')
 
-    for idx, point in enumerate(points):
-        feature = QgsFeature(layer.fields(), idx)
-        qgspoint = QgsPointXY(point[0], point[1])
-        geometry = QgsGeometry.fromPointXY(qgspoint)
-        feature.setAttribute(0, idx)
-        feature.setGeometry(geometry)
-        flist = [feature]
+    fields = layer.fields()
 
-        layer.dataProvider().addFeatures(flist)
+    # Python values by row (tolist is much faster than numpy scalars)
+    rows = zip(*(values.tolist() if values.dtype.kind in _MEMORY_FIELD_TYPES
+                 else values.astype(str).tolist()
+                 for values in columns.values()))
 
-    QgsProject.instance().addMapLayer(
-        layer)
+    flist = []
+    for (x, y), row in zip(xy.tolist(), rows):
+        feature = QgsFeature(fields)
+        feature.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(x, y)))
+        feature.setAttributes(list(row))
+        flist.append(feature)
+
+    layer.dataProvider().addFeatures(flist)
+    layer.updateExtents()
+
+    return layer
+
+
+def _write_points_gpkg(xy, crs, columns, utf8_path, baseName):
+    """Write the points to a GeoPackage layer in a single transaction."""
+
+    if os.path.exists(utf8_path):
+        datasource = ogr.Open(utf8_path, 1)
+    else:
+        datasource = ogr.GetDriverByName('GPKG').CreateDataSource(utf8_path)
+
+    if datasource is None:
+        raise Exception(f"Can't open {utf8_path} as a GeoPackage.")
+
+    spat_ref = osr.SpatialReference()
+    spat_ref.SetFromUserInput(crs)
+    spat_ref.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+
+    ogr_layer = datasource.CreateLayer(
+        baseName,
+        spat_ref,
+        ogr.wkbPoint,
+        options=['OVERWRITE=YES'])
+
+    for name, values in columns.items():
+        ogr_layer.CreateField(
+            ogr.FieldDefn(name, _OGR_FIELD_TYPES.get(values.dtype.kind,
+                                                     ogr.OFTString)))
+
+    rows = zip(*(values.tolist() if values.dtype.kind in _OGR_FIELD_TYPES
+                 else values.astype(str).tolist()
+                 for values in columns.values()))
+
+    defn = ogr_layer.GetLayerDefn()
+
+    datasource.StartTransaction()
+    for (x, y), row in zip(xy.tolist(), rows):
+        feature = ogr.Feature(defn)
+        for i, value in enumerate(row):
+            feature.SetField(i, value)
+        geometry = ogr.Geometry(ogr.wkbPoint)
+        geometry.AddPoint_2D(x, y)
+        feature.SetGeometryDirectly(geometry)
+        ogr_layer.CreateFeature(feature)
+    datasource.CommitTransaction()
+
+    ogr_layer = None
+    datasource = None